@@ -11,12 +11,11 @@ import pandas as pd
 from sklearn import decomposition, manifold
 import itertools
 import hdbscan
-from lifelines.statistics import logrank_test
 
 
 
 #------------------------------read in files----------------------------------# 
-X = "metabric/metabric_dct.csv" #metabric gene expression after DSGA transformation 
+X = hm.datasets.load_expression("metabric/metabric_dct.csv") #metabric gene expression after DSGA transformation 
 rfs = "metabric/10_year_rfs.csv" #relapse free event & time censored to 10 years. 
 
 #define the attribute function as patients who have relapsed before 10 years
@@ -64,30 +63,22 @@ while count < runs:
         hotspot_id = []
         columns = ["interval", "overlap", "nodes", "size", "logrank"]
         
+        #the log-rank test is run once for each distinct hotspot, as neighbouring 
+        #parameter options often produce the same hotspot samples. All are tested in one batch 
+        search.score_survival(rfs["Time"], rfs["Event"] == "1:Recurred")
+        
         #multiple graphs are generated from the different successful parameter options 
         #the hotspots in each graph are tested for significant survival 
         for ps, collection in search.parameter_samples.items():
             for i, hotspot_samples in enumerate(collection):
                 hotspot_results = []
-                #seperate the er+ cohort into hotspot and global neighbourhood
-                y = pd.DataFrame([0] * len(X.index), columns = ["Hotspot"], index = X.index)
-                X_H = X.iloc[hotspot_samples]
-                y.loc[X_H.index,"Hotspot"] = 1
-                
-                #apply log rank test to each hotspot division 
-                hot = (y["Hotspot"] == 1)
-                T = rfs["Time"]
-                E = rfs["Event"]
-        
-                lr = logrank_test(T[hot], T[~hot], event_observed_A=E[hot], event_observed_B=E[~hot], alpha=99)
-                pvalue = lr.p_value
-                
+                pvalue = search.distinct_hotspots[search.hotspot_index[(ps[0], ps[1], i)]]["logrank"]
                 
                 #if any hotspots have lower p-value than 0.001 then results are saved 
                 if pvalue < 0.01:
                     #append results to list to build dataframe summarising survival analysis for each hotspot 
                     hotspot_id.append(str(ps[0]) + str(int(ps[1] * 100)) + str(i))
-                    hotspot_results = [ps[0], ps[1], p_success[ps][i], sum(y["Hotspot"]), pvalue]
+                    hotspot_results = [ps[0], ps[1], p_success[ps][i], len(hotspot_samples), pvalue]
                     survival_results.append(hotspot_results)
                     signficance = True
 
@@ -13,7 +13,7 @@ from itertools import chain
 
 
 #------------------------------read in files----------------------------------# 
-X = "metabric/metabric_dct.csv" #metabric gene expression after DSGA transformation 
+X = hm.datasets.load_expression("metabric/metabric_dct.csv") #metabric gene expression after DSGA transformation 
 rfs = "metabric/10_year_rfs.csv" #relapse free event & time censored to 10 years. 
 
 #define the attribute function as patients who have relapsed before 10 years
@@ -38,7 +38,7 @@ mapper.build_graph()
 # visualise the graph, colouring by relapse outcome
 hm.visualisation.draw_graph(mapper_graph = mapper.graph, 
           attribute_function = outcome, 
-          samples_in_nodes = mapper.samples_in_nodes,
+          samples_in_nodes = mapper.node_membership,
           size = 10, 
           style =3, 
           col_legend_title = "Relapse before\n 10 years",
@@ -49,7 +49,7 @@ hm.visualisation.draw_graph(mapper_graph = mapper.graph,
 #----------------------confirm presence of hotspots--------------------------------#
 hotspot_search = hm.hotspot.HotspotSearch(mapper_graph = mapper.graph,
                                           attribute_function = outcome, 
-                                          samples_in_nodes = mapper.samples_in_nodes)
+                                          samples_in_nodes = mapper.node_membership)
 
 #check the distribution of hotspot nodes 
 hotspot_nodes = hotspot_search.search_graph(attribute_threshold = 0.1, 
@@ -61,7 +61,7 @@ n = list(chain.from_iterable(hotspot_nodes))
 #visualise again but highlight the nodes in the graph identified as hotspots
 hm.visualisation.draw_graph(mapper_graph = mapper.graph, 
           attribute_function = outcome, 
-          samples_in_nodes = mapper.samples_in_nodes,
+          samples_in_nodes = mapper.node_membership,
           size = 10, 
           style = 3, 
           hotspot_nodes = n,
@@ -73,9 +73,8 @@ print(f"hotspots... {n}")
 
 
 #save hotspot class 
-node_id = mapper.samples_in_nodes
-node_id.index = X.index
-y = pd.DataFrame(node_id[n].max(axis=1), columns = ["Hotspot"])
+y = pd.DataFrame(0, index = X.index, columns = ["Hotspot"])
+y.iloc[hm.utils.samples_in_node_list(mapper.node_membership, n), 0] = 1
 
 #----------------------save files--------------------------------#
 #save the 287 genes found in the lens function 
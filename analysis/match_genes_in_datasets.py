@@ -5,9 +5,9 @@ Created on Mon Mar 21 16:45:19 2022
 @author: ciara
 """
 
+import hotmapper as hm
 import numpy as np 
 import pandas as pd
-from sklearn.impute import KNNImputer
 
 
 def check_for_missing_data(list_of_datasets):
@@ -17,26 +17,19 @@ def check_for_missing_data(list_of_datasets):
 
 def match_tumour_normal_data(list_of_tumour_datasets, normal_dataset):
     for dataset_name,tumour_dataset in list_of_tumour_datasets.items():
-        #transpose data
-        tumour_dataset_T = tumour_dataset.T
-        normal_dataset_T = normal_dataset.T
+        #match the genes (rows) of both datasets, in the order of the normal dataset
+        alignment = hm.gene_alignment.GeneAlignment({"normal" : normal_dataset.index, dataset_name : tumour_dataset.index})
         
-        #obtain list of genes in both datasets 
-        tumour_genes = tumour_dataset_T.columns
-        normal_genes = normal_dataset_T.columns
-    
-        #match the names 
-        matched_genes = [i for i in normal_genes if i in tumour_genes]
-        
-        #subset original datasets
-        tumour_matched = tumour_dataset_T[matched_genes]
-        normal_matched = normal_dataset_T[matched_genes]
+        #subset original datasets, patients as rows and genes as columns
+        tumour_matched = alignment.select(dataset_name, tumour_dataset, axis = 0).T
+        normal_matched = alignment.select("normal", normal_dataset, axis = 0).T
         
         print(F"{dataset_name}: \n tumour shape ({tumour_matched.shape} \n normal shape {normal_matched.shape})")
         
         #save to file 
         tumour_matched.to_csv(F"{dataset_name}_tumour_matched.csv") 
         normal_matched.to_csv(F"{dataset_name}_normal_matched.csv") 
+        alignment.save(F"{dataset_name}_gene_alignment.npz")
 
 
 
@@ -44,9 +37,9 @@ def match_tumour_normal_data(list_of_tumour_datasets, normal_dataset):
 
 #-----------read in files----------------------------------# 
 #read in the gene expression datasets 
-metabric = "metabric/gene_expression.csv" #18930 genes, 1429 er+ bc patients
-tcga = "tcga/gene_expression.csv" #19957 genes, 790 er+ bc patients
-gtex = "gtex/gene_expression.csv" #36043 genes, 169 healthy patients
+metabric = hm.datasets.load_expression("metabric/gene_expression.csv") #18930 genes, 1429 er+ bc patients
+tcga = hm.datasets.load_expression("tcga/gene_expression.csv") #19957 genes, 790 er+ bc patients
+gtex = hm.datasets.load_expression("gtex/gene_expression.csv") #36043 genes, 169 healthy patients
 
 
 
@@ -56,8 +49,8 @@ missing_data_no = check_for_missing_data([metabric, tcga, gtex])
 print(F"number of missing genes: {missing_data_no}")
 
 #There is missing data for 434 genes in the TCGA dataset, these are imputed using KNN
-imputer = KNNImputer(n_neighbors=10)
-tcga = pd.DataFrame(imputer.fit_transform(tcga), columns = tcga.columns, index = tcga.index)
+#neighbours are found from the first 50 principal components, only the columns with missing data are imputed
+tcga = hm.preprocessing.knn_impute(tcga, n_neighbors = 10, n_components = 50)
 
 #There is a large amount of missing data in GTEX (2594 genes). These genes are removed 
 gtex = gtex.replace(-np.inf, np.nan).dropna()
@@ -9,14 +9,13 @@ import hotmapper as hm
 import numpy as np
 import pandas as pd
 import hdbscan
-from lifelines.statistics import logrank_test
 
 
 
 
 #------------------------------read in files----------------------------------# 
 #tcga gene expression after DSGA transformation 
-X = "tcga/tcga_dct.csv" 
+X = hm.datasets.load_expression("tcga/tcga_dct.csv") 
 
 #mapper graph will be coloured by survival time censored to 10 years
 surv = "tcga/10_year_survival.csv" #survival event & time censored to 10 years
@@ -27,6 +26,11 @@ outcome = np.array((surv['Time']<=120) & (surv['Event'] == "1:DECEASED")).astype
 weights = "metabric/weights.txt"
 feature_list = "metabric/feature_list.txt"
 
+#the lens features index the metabric genes, map them to the same genes in tcga
+X_meta = hm.datasets.load_expression("metabric/metabric_dct.csv")
+alignment = hm.gene_alignment.GeneAlignment({"metabric" : X_meta.columns, "tcga" : X.columns})
+feature_list = alignment.map_features(feature_list, "metabric", "tcga")
+
 
 
 
@@ -62,27 +66,20 @@ survival_results = []
 hotspot_id = []
 columns = ["interval", "overlap", "nodes", "size", "logrank"]
 
+#the log-rank test is run once for each distinct hotspot, as neighbouring 
+#parameter options often produce the same hotspot samples. All are tested in one batch 
+search.score_survival(surv["Time"], surv["Event"] == "1:DECEASED")
+
 #multiple graphs are generated from the different successful parameter options 
 #the hotspots in each graph are tested for significant survival 
 for ps, collection in search.parameter_samples.items():
     for i, hotspot_samples in enumerate(collection):
         hotspot_results = []
-        #seperate the er+ cohort into hotspot and global neighbourhood
-        y = pd.DataFrame([0] * len(X.index), columns = ["Hotspot"], index = X.index)
-        X_H = X.iloc[hotspot_samples]
-        y.loc[X_H.index,"Hotspot"] = 1
-        
-        #apply log rank test to each hotspot division 
-        hot = (y["Hotspot"] == 1)
-        T = surv["Time"]
-        E = surv["Event"]
-
-        lr = logrank_test(T[hot], T[~hot], event_observed_A=E[hot], event_observed_B=E[~hot], alpha=99)
-        pvalue = lr.p_value
+        pvalue = search.distinct_hotspots[search.hotspot_index[(ps[0], ps[1], i)]]["logrank"]
         
         #append results to list to build dataframe summarising survival analysis for each hotspot 
         hotspot_id.append(str(ps[0]) + str(int(ps[1] * 100)) + str(i))
-        hotspot_results = [ps[0], ps[1], p_success[ps][i], sum(y["Hotspot"]), pvalue]
+        hotspot_results = [ps[0], ps[1], p_success[ps][i], len(hotspot_samples), pvalue]
         survival_results.append(hotspot_results)
 
             
@@ -18,7 +18,7 @@ from sklearn.metrics import pairwise_distances
 
 #------------------------------read in files----------------------------------# 
 #tcga gene expression after DSGA transformation 
-X_tcga = "tcga/tcga_dct.csv" 
+X_tcga = hm.datasets.load_expression("tcga/tcga_dct.csv") 
 
 #mapper graph will be coloured by survival time censored to 10 years
 os = "tcga/10_year_os.csv" #10-year overall survival event & time censored to 10 years. 
@@ -32,12 +32,16 @@ weights = "metabric/weights.txt"
 feature_list = "metabric/feature_list.txt"
 
 #we will also look at the distance of the tcga hotspot to the metabric hotspot 
-X_meta = "metabric/metabric_dct.csv" 
+X_meta = hm.datasets.load_expression("metabric/metabric_dct.csv") 
 y_meta = "metabric/hotspot_labels.csv" 
 
+#the lens features index the metabric genes, map them to the same genes in tcga
+alignment = hm.gene_alignment.GeneAlignment({"metabric" : X_meta.columns, "tcga" : X_tcga.columns})
+tcga_features = alignment.map_features(feature_list, "metabric", "tcga")
+
 #----------------------build mapper graph--------------------------------#
 #construct the lens function
-linear_lens = hm.random_lens.Lens(np.array(X_tcga), nonzero_features = len(weights), weights = weights, feature_list = feature_list)
+linear_lens = hm.random_lens.Lens(np.array(X_tcga), nonzero_features = len(weights), weights = weights, feature_list = tcga_features)
 
 # build the mapper graph according to the identified parameters
 mapper = hm.mapper.MapperGraph(data = np.array(X_tcga), 
@@ -50,7 +54,7 @@ mapper.build_graph()
 # visualise the graph, colouring by overall survival outcome
 hm.visualisation.draw_graph(mapper_graph = mapper.graph, 
           attribute_function = outcome, 
-          samples_in_nodes = mapper.samples_in_nodes,
+          samples_in_nodes = mapper.node_membership,
           size = 10, 
           style =3, 
           col_legend_title = "Event before\n 10 years",
@@ -61,7 +65,7 @@ hm.visualisation.draw_graph(mapper_graph = mapper.graph,
 #----------------------confirm presence of hotspots--------------------------------#
 hotspot_search = hm.hotspot.HotspotSearch(mapper_graph = mapper.graph,
                                           attribute_function = outcome, 
-                                          samples_in_nodes = mapper.samples_in_nodes)
+                                          samples_in_nodes = mapper.node_membership)
 
 #check the distribution of hotspot nodes 
 hotspot_nodes = hotspot_search.search_graph(attribute_threshold = 0.1, 
@@ -73,7 +77,7 @@ n = list(chain.from_iterable(hotspot_nodes))
 #visualise again but highlight the nodes in the graph identified as hotspots
 hm.visualisation.draw_graph(mapper_graph = mapper.graph, 
           attribute_function = outcome, 
-          samples_in_nodes = mapper.samples_in_nodes,
+          samples_in_nodes = mapper.node_membership,
           size = 10, 
           style = 3, 
           hotspot_nodes = n,
@@ -84,16 +88,15 @@ hm.visualisation.draw_graph(mapper_graph = mapper.graph,
 print(f"hotspots... {n}")
 
 #save hotspot class 
-node_id = mapper.samples_in_nodes
-node_id.index = X_tcga.index
-y_tcga = pd.DataFrame(node_id[n].max(axis=1), columns = ["Hotspot"])
+y_tcga = pd.DataFrame(0, index = X_tcga.index, columns = ["Hotspot"])
+y_tcga.iloc[hm.utils.samples_in_node_list(mapper.node_membership, n), 0] = 1
 
 
 
 #-------------------investigate hotspot distance to discovery hotspot centroid----------------#
 #we can also visualise graph by the distance to metabric centroid 
 #only consider genes involved in lens function
-X_tcga_lens = X_tcga[X_tcga.columns[feature_list]]
+X_tcga_lens = X_tcga[X_tcga.columns[tcga_features]]
 X_meta_lens = X_meta[X_meta.columns[feature_list]]
 
 #find the centroid of the METABRIC hotspot samples 
@@ -107,7 +110,7 @@ centroid_dist = [i[0] for i in dist]
 #visualise graph with 'distance to metabric centroid by lens function genes' as attribute 
 hm.visualisation.draw_graph(mapper_graph = mapper.graph, 
       attribute_function = centroid_dist, 
-      samples_in_nodes = mapper.samples_in_nodes,
+      samples_in_nodes = mapper.node_membership,
       size = 10, 
       style = 2, 
       hotspot_nodes = n,
@@ -7,38 +7,90 @@ A module to create a filter function based on Disease-genomic specific analysis
 @author: ciara
 """
 
+import os
+import sys
 import numpy as np
 from sklearn.decomposition import PCA
 import scipy.signal as ss
-from scipy.stats.stats import pearsonr
+from scipy.stats import pearsonr
 import pandas as pd
 
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
 
 
 
-def flat_construction(df_N):
+
+def flat_construction(df_N, block_size = None):
     """Perform FLAT construction by constructing a linear model fit of the
-    normal tumour vector genes as rows and samples as columns"""
-    df_normal = df_N.to_numpy()
+    normal tumour vector genes as rows and samples as columns.
+
+    Each column of the normal vector is fit by least squares on all the other columns.
+    Every leave-one-out fit is found from one SVD of the normal vector A = U S V^T:
+    removing column i only changes the column space of A when column i is not spanned
+    by the other columns (leverage |v_i|^2 = 1). The fit is then the projection of
+    column i onto col(A) minus the rank-one downdate U S^-1 v_i / |S^-1 v_i|^2,
+    otherwise it is the projection itself. Matches the per column np.linalg.lstsq fits
+    to numerical tolerance.
+
+    block_size : int, default: ``None``
+        Number of columns fit together, bounding the memory used for large inputs.
+        All columns are fit at once if None"""
+    df_normal = np.asarray(df_N, dtype=np.float64) #the tolerances below are for float64
     normal_T = df_normal.transpose()
     normal_FLAT = np.empty(normal_T.shape)
     print(normal_T.shape)
-    #for each gene in the normal vector
-    for i in range(0,normal_T.shape[1]):
-        n_i = normal_T[:,i] #take each gene seperately
-        normal_i = np.delete(normal_T, i, 1) #remove it from the dataframe
-        x = np.linalg.lstsq(normal_i, n_i, rcond=None) #construct linear model
-        b = normal_i@x[0] #find fit of model
-        normal_FLAT[:,i] = b #this is the new normal vector value
+    n_samples, n_genes = normal_T.shape
+
+    #one SVD of the normal vector, keeping the singular values lstsq would keep
+    U, sin_val, Vt = np.linalg.svd(normal_T, full_matrices=False)
+    if len(sin_val) == 0 or sin_val[0] == 0:
+        normal_FLAT[:] = 0
+        return normal_FLAT
+    cutoff = np.finfo(float).eps * max(n_samples, n_genes - 1) * sin_val[0]
+    rank = int(np.sum(sin_val > cutoff))
+    U, sin_val, Vt = U[:,:rank], sin_val[:rank], Vt[:rank]
+
+    leverage_tol = np.finfo(float).eps * max(n_samples, n_genes)
+    if block_size is None:
+        block_size = n_genes
+
+    #for each block of columns in the normal vector
+    for start in range(0, n_genes, block_size):
+        v = Vt[:, start:start + block_size]
+        leverage = np.sum(np.square(v), axis=0)
+        v_scaled = v / sin_val[:,None]
+        inverse_diag = np.sum(np.square(v_scaled), axis=0) #diagonal of (A^T A)^+
+
+        #columns not spanned by the other columns have leverage 1 up to rounding
+        essential = (inverse_diag > 0) & (1 - leverage <= leverage_tol)
+
+        coef = v * sin_val[:,None] #projection of each column onto col(A)
+        coef[:, essential] -= v_scaled[:, essential] / inverse_diag[essential]
+        normal_FLAT[:, start:start + block_size] = U @ coef #this is the new normal vector value
 
     return normal_FLAT
 
 
-def wold_invariant(normal_FLAT):
+def wold_invariant(normal_FLAT, n_components = None, random_state = None):
     """Compute and plot the Wold invariant of PCA. Identify the number of
-    principal components for the healthy state model"""
+    principal components for the healthy state model.
+
+    n_components : int, default: ``None``
+        Number of principal components found with a randomized SVD. The Wold
+        invariant of these components is exact, the variance of the components
+        left out is the total variance less that of the components found.
+        All components are found with a full SVD if None
+
+    random_state : int, default: ``None``
+        Seed for the randomized SVD"""
     features_no = normal_FLAT.shape[1] #number of samples
-    pca = PCA(n_components=features_no)
+    if n_components is None or n_components >= min(normal_FLAT.shape):
+        pca = PCA(n_components=features_no)
+    else:
+        pca = PCA(n_components=n_components, svd_solver="randomized", random_state=random_state)
     principalComponents = pca.fit_transform(normal_FLAT)
 
     sin_val = pca.singular_values_ #singular values
@@ -47,8 +99,23 @@ def wold_invariant(normal_FLAT):
     R = normal_FLAT.shape[1]
     n = normal_FLAT.shape[0]
 
-    #calculate list holding Wold invariant values
-    wold = [(sin_val_sqr[l]/(np.sum(sin_val_sqr[l+1:])))*(((n-l-1)*(R-l))/(n+R-2*l)) for l in range(0,R)]
+    #variance of any components not found
+    residual = max(np.sum(np.square(normal_FLAT - pca.mean_)) - np.sum(sin_val_sqr), 0) if len(sin_val) < R else 0
+    spike_index = _wold_spike_index(sin_val_sqr, n, R, residual)
+
+    return (principalComponents, spike_index)
+
+
+def _wold_spike_index(sin_val_sqr, n, R, residual = 0):
+    """Index of the most prominent peak of the Wold invariant from the squared singular values"""
+    #sum of the squared singular values after each component, from a reversed cumulative
+    #sum and the variance of any components not found
+    tail = np.append(np.cumsum(sin_val_sqr[::-1])[::-1][1:], 0) + residual
+
+    #calculate Wold invariant values
+    l = np.arange(len(sin_val_sqr))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wold = (sin_val_sqr/tail)*(((n-l-1)*(R-l))/(n+R-2*l))
 
     #find the most prominent peak in Wold value
     peaks, _ = ss.find_peaks(wold)
@@ -58,14 +125,14 @@ def wold_invariant(normal_FLAT):
     spike = np.amax(prominences)
     spike_index = peaks[np.where(prominences == spike)]
 
-    return (principalComponents, spike_index)
+    return spike_index
 
 
 def HSM(df_T, principalComponents, spike_index):
     """Choose the number of Wold components to build the Healthy State Model"""
     df_tumour = df_T.to_numpy()
     tumour_T = df_tumour.transpose()
-    HSM = principalComponents[:,:int(spike_index)]
+    HSM = principalComponents[:,:int(np.ravel(spike_index)[0])]
     #fit tumour vector to healthy state model
     x = np.linalg.lstsq(HSM, tumour_T, rcond=None)
 
@@ -75,10 +142,11 @@ def HSM(df_T, principalComponents, spike_index):
     return DcT
 
 
-def threshold_coord(DcT):
+def threshold_coord(DcT, max_bytes = 2**28):
     """Threshold data coordinates (genes, proteins, etc.)
     #so that only the genes that show a significant deviation
-    #from the healthy state are retained). Input Pandas dataframe"""
+    #from the healthy state are retained). Input Pandas dataframe.
+    max_bytes bounds the memory of each block of correlations"""
     #find the 5th and 95th quantile of each gene
     #take the absolute value
     q_df = pd.DataFrame({"Q5":DcT.quantile(q=0.05, axis=1),
@@ -94,56 +162,243 @@ def threshold_coord(DcT):
     stringent = DcT[q_abs > q98]
 
 
-    #empty dataframe of patients
-    Dc_mat = pd.DataFrame(columns = DcT.columns)
-
-    #if the gene passess the 85th threshold
-    for i in range(0 , len(relaxed)):
-        correlation_QR = []
-        gene_r = relaxed.iloc[i,:]
+    #correlation between each relaxed gene and each stringent gene, from the product
+    #of the mean centred genes scaled to unit norm, as in pearsonr
+    relaxed_std = _standardise_rows(relaxed.to_numpy(dtype=float))
+    stringent_std = _standardise_rows(stringent.to_numpy(dtype=float))
 
-        #find the correlation between that gene and the stringent genes
-        for j in range(0 , len(stringent)):
-            gene_s = stringent.iloc[j,:]
+    #count the stringent genes each relaxed gene correlates with, in blocks of relaxed genes
+    block_size = max(1, max_bytes // (8 * max(len(stringent), 1)))
+    sig_sum = np.zeros(len(relaxed), dtype=int)
+    for start in range(0, len(relaxed), block_size):
+        with np.errstate(invalid="ignore"):
+            corr = np.clip(relaxed_std[start:start + block_size] @ stringent_std.T, -1, 1)
 
-            corr, _ = pearsonr(gene_r, gene_s)
-            correlation_QR.append(corr)
+        #recompute correlations within rounding of the threshold with pearsonr
+        for i, j in zip(*np.nonzero(np.abs(corr - 0.6) < 1e-9)):
+            corr[i, j], _ = pearsonr(relaxed.iloc[start + i,:], stringent.iloc[j,:])
 
-        #if r>0.6 with over 3 stringent genes
-        sig_sum = sum(val > 0.6 for val in correlation_QR)
+        #r>0.6
+        sig_sum[start:start + block_size] = np.sum(corr > 0.6, axis=1)
 
-        #retain that gene
-        if sig_sum > 0.6:
-            Dc_mat = Dc_mat.append(gene_r)
+    #retain the genes correlating with a stringent gene
+    Dc_mat = relaxed[sig_sum > 0.6]
 
     #return matrix so patients are rows and genes columns for lens
     Dc_mat_T = Dc_mat.T
     return Dc_mat_T
 
 
-def DSGA(df_normal, df_tumour, threshold = True):
+def _standardise_rows(genes):
+    """Centre each gene on its mean and scale it to unit norm, constant genes become nan"""
+    centred = genes - genes.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return centred / np.linalg.norm(centred, axis=1, keepdims=True)
+
+
+class HealthyStateModel():
+    """Healthy state model of normal tissue for the disease-specific genomic analysis.
+    fit builds the FLAT construction of the normal data and keeps the principal components
+    up to the Wold invariant spike as the healthy state basis. transform fits tumour data
+    to the basis in one least squares solve and returns its disease component, so new
+    tumour batches are projected without refitting. The basis, genes and any selected
+    genes are saved to and loaded from an npz file.
+
+    Parameters
+    ----------
+
+    n_components : int, default: ``None``
+        Number of principal components found for the Wold invariant, all are found if None
+
+    block_size : int, default: ``None``
+        Number of columns fit together in the FLAT construction
+        """
+
+    def __init__(self, n_components = None, block_size = None):
+        self.n_components = n_components
+        self.block_size = block_size
+        self.basis = None
+        self.genes = None
+        self.selected_genes = None
+
+    def fit(self, df_normal):
+        """Build the healthy state basis from normal data with patients as rows and genes as columns"""
+        #obtain flat construction of normal genes
+        normal_flat = flat_construction(df_normal, block_size = self.block_size)
+
+        #calculate the number Wold principal components
+        #and the value at which they spike
+        principalComponents, spike_index = wold_invariant(normal_flat, n_components = self.n_components)
+
+        self.basis = principalComponents[:,:int(spike_index[0])]
+        self.genes = np.asarray(df_normal.columns)
+        self.selected_genes = None
+        return self
+
+    def disease_component(self, df_tumour):
+        """Disease component of tumour data with patients as rows and genes as columns,
+        returned with genes as rows and patients as columns"""
+        if self.basis is None:
+            raise ValueError("HealthyStateModel has not been fit")
+        missing = pd.Index(self.genes).difference(df_tumour.columns)
+        if len(missing) > 0:
+            raise ValueError(F"{len(missing)} genes of the healthy state model are missing from the tumour data")
+        tumour_T = df_tumour[self.genes].to_numpy().transpose()
+
+        #fit tumour vector to healthy state model
+        x = np.linalg.lstsq(self.basis, tumour_T, rcond=None)
+        DcT = tumour_T - self.basis@x[0] #diseased component
+
+        return pd.DataFrame(data=DcT,
+                            index=self.genes,
+                            columns=df_tumour.index)
+
+    def select_genes(self, df_tumour):
+        """Threshold the disease component of tumour data and keep the retained genes,
+        later transforms return only these genes"""
+        Dc_mat = threshold_coord(self.disease_component(df_tumour))
+        self.selected_genes = np.asarray(Dc_mat.columns)
+        return Dc_mat
+
+    def transform(self, df_tumour):
+        """Disease component of tumour data with patients as rows and genes as columns,
+        restricted to the selected genes if genes have been selected"""
+        DcT_df = self.disease_component(df_tumour)
+        if self.selected_genes is not None:
+            DcT_df = DcT_df.loc[self.selected_genes]
+        return DcT_df.T
+
+    def fit_chunked(self, normal, genes = None, block_size = 4096):
+        """Build the healthy state basis out of core from a (patients x genes) float32 array
+        or .npy file, read in blocks of genes. The FLAT construction is a linear map F = A K
+        of the normal vector A = normal^T, so K and the principal components of F are found
+        from the (patients x patients) Gram matrix of A, accumulated in float64 over the gene
+        blocks. Only the basis (genes x Wold components) is held in memory. Results match fit
+        to the precision of the float32 input"""
+        normal = _open_array(normal)
+        n_patients, n_genes = normal.shape
+
+        #Gram matrix and patient sums of the normal vector
+        gram = np.zeros((n_patients, n_patients))
+        sums = np.zeros(n_patients)
+        for start in range(0, n_genes, block_size):
+            block = np.asarray(normal[:, start:start + block_size], dtype=np.float64).T
+            gram += block.T@block
+            sums += block.sum(axis=0)
+
+        #FLAT construction as a linear map, removing column i only changes the fit
+        #of columns not spanned by the other columns (leverage 1)
+        eig_val, V = _sorted_eigh(gram)
+        rank = int(np.sum(eig_val > np.finfo(float).eps * max(n_patients, n_genes) * eig_val[0]))
+        eig_val, V = eig_val[:rank], V[:,:rank]
+        leverage = np.sum(np.square(V), axis=1)
+        gram_inverse = (V / eig_val)@V.T
+        inverse_diag = np.diag(gram_inverse)
+        essential = (inverse_diag > 0) & (1 - leverage <= np.finfo(float).eps * max(n_patients, n_genes))
+        K = np.eye(n_patients)
+        K[:, essential] -= gram_inverse[:, essential] / inverse_diag[essential]
+
+        #PCA of the FLAT construction from its centred Gram matrix
+        mean = sums / n_genes
+        flat_gram = K.T@(gram - n_genes * np.outer(mean, mean))@K
+        sin_val_sqr, W = _sorted_eigh(flat_gram)
+        sin_val_sqr = np.maximum(sin_val_sqr, 0)
+        spike_index = _wold_spike_index(sin_val_sqr, n_genes, n_patients)
+
+        #the principal components up to the spike are the healthy state basis
+        projection = K@W[:,:int(spike_index[0])]
+        self.basis = np.empty((n_genes, projection.shape[1]))
+        for start in range(0, n_genes, block_size):
+            block = np.asarray(normal[:, start:start + block_size], dtype=np.float64).T
+            self.basis[start:start + block_size] = (block - mean)@projection
+
+        self.genes = np.asarray(genes) if genes is not None else np.arange(n_genes)
+        self.selected_genes = None
+        return self
+
+    def transform_chunked(self, tumour, output, block_size = 4096):
+        """Write the disease component of a (patients x genes) float32 array or .npy file,
+        with genes in the order of the model, to a (genes x patients) float32 .npy memory
+        map at output. The tumour data is read in blocks of genes, once to fit it to the
+        healthy state basis and once to write the disease component"""
+        if self.basis is None:
+            raise ValueError("HealthyStateModel has not been fit")
+        tumour = _open_array(tumour)
+        n_patients, n_genes = tumour.shape
+        if n_genes != len(self.basis):
+            raise ValueError(F"tumour data has {n_genes} genes, the healthy state model has {len(self.basis)}")
+
+        #fit tumour vector to healthy state model from the normal equations of the basis
+        basis_tumour = np.zeros((self.basis.shape[1], n_patients))
+        for start in range(0, n_genes, block_size):
+            block = np.asarray(tumour[:, start:start + block_size], dtype=np.float64).T
+            basis_tumour += self.basis[start:start + block_size].T@block
+        x = np.linalg.lstsq(self.basis.T@self.basis, basis_tumour, rcond=None)[0]
+
+        #diseased component
+        DcT = np.lib.format.open_memmap(output, mode="w+", dtype=np.float32, shape=(n_genes, n_patients))
+        for start in range(0, n_genes, block_size):
+            block = np.asarray(tumour[:, start:start + block_size], dtype=np.float64).T
+            DcT[start:start + block_size] = block - self.basis[start:start + block_size]@x
+        DcT.flush()
+        return DcT
+
+    def save(self, filename):
+        """Save the model to an npz file, gene names are stored as strings"""
+        if self.basis is None:
+            raise ValueError("HealthyStateModel has not been fit")
+        selected = self.selected_genes if self.selected_genes is not None else []
+        np.savez(filename,
+                 basis = self.basis,
+                 genes = np.asarray(self.genes).astype(str),
+                 selected_genes = np.asarray(selected).astype(str),
+                 has_selection = self.selected_genes is not None)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a model saved with save"""
+        with np.load(filename) as saved:
+            model = cls()
+            model.basis = saved["basis"]
+            model.genes = saved["genes"]
+            model.selected_genes = saved["selected_genes"] if saved["has_selection"] else None
+        return model
+
+
+def _open_array(data):
+    """Memory map a .npy file, other arrays are used as they are"""
+    if isinstance(data, (str, os.PathLike)):
+        return np.load(data, mmap_mode="r")
+    return data
+
+
+def _sorted_eigh(matrix):
+    """Eigenvalues and eigenvectors of a symmetric matrix, largest eigenvalue first"""
+    eig_val, eig_vec = np.linalg.eigh(matrix)
+    return eig_val[::-1], eig_vec[:,::-1]
+
+
+def peak_memory():
+    """Peak resident memory of the process in bytes, None where it cannot be measured"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 #kilobytes on Linux
+
+
+def DSGA(df_normal, df_tumour, threshold = True, n_components = None):
     """Function to calculate the disease-specific genomic analysis
-    filter function"""
+    filter function. n_components caps the principal components found
+    for the Wold invariant, all are found if None"""
 
-    #obtain flat construction of normal genes
-    df_normal_flat = flat_construction(df_normal)
-
-    #calculate the number Wold principal components
-    #and the value at which they spike
-    principalComponents, spike_index = wold_invariant(df_normal_flat)
-
-    #construct a healthy state model using the tumour data
-    DcT = HSM(df_tumour, principalComponents, spike_index)
-
-    #convert DcT to a pandas numpy with the genes and columns kept
-    DcT_df =  pd.DataFrame(data=DcT,
-                           index=df_tumour.columns,
-                           columns=df_tumour.index)
-    Dc_mat = DcT_df
+    #construct a healthy state model from the normal data
+    model = HealthyStateModel(n_components = n_components).fit(df_normal)
 
     if threshold == True:
-        #threshold the data coordinates
-        Dc_mat = threshold_coord(DcT_df)
+        #threshold the data coordinates of the tumour disease component
+        Dc_mat = model.select_genes(df_tumour)
+    else:
+        Dc_mat = model.disease_component(df_tumour)
 
     print("\n")
     if threshold == True:
@@ -152,3 +407,23 @@ def DSGA(df_normal, df_tumour, threshold = True):
         print(str(Dc_mat.shape[0]) + " co-ordinates are retained")
 
     return(Dc_mat)
+
+
+def DSGA_chunked(normal, tumour, output, genes = None, block_size = 4096):
+    """Out of core disease-specific genomic analysis for large gene sets. The normal and
+    tumour data are (patients x genes) float32 arrays or .npy files with the same genes,
+    streamed in blocks of genes from memory maps. The disease component (genes x patients)
+    is written to a float32 .npy memory map at output and returned, and the peak resident
+    memory is reported"""
+
+    #construct a healthy state model from the normal data
+    model = HealthyStateModel().fit_chunked(normal, genes = genes, block_size = block_size)
+    DcT = model.transform_chunked(tumour, output, block_size = block_size)
+
+    print("\n")
+    print(str(DcT.shape[0]) + " co-ordinates are retained")
+    peak = peak_memory()
+    if peak is not None:
+        print(F"Peak resident memory: {peak / 2**20:.0f} MB")
+
+    return DcT
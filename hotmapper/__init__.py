@@ -3,4 +3,9 @@ import hotmapper.random_lens
 import hotmapper.hotspot
 import hotmapper.utils
 import hotmapper.visualisation
-import hotmapper.automated_parameter_search
\ No newline at end of file
+import hotmapper.automated_parameter_search
+import hotmapper.survival
+import hotmapper.search_strategies
+import hotmapper.datasets
+import hotmapper.gene_alignment
+import hotmapper.preprocessing
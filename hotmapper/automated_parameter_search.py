@@ -3,7 +3,215 @@ import hotmapper.utils as utils
 import hotmapper.hotspot as hotspot_algorithm
 import hotmapper.random_lens as linear_lens_combination
 import hotmapper.visualisation as mapper_plot
+import hotmapper.survival as survival_analysis
+import hotmapper.search_strategies as search_strategies
+import os
+import pickle
+import time
+import threading
+import numpy as np
+import pandas as pd
 from itertools import product
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from sklearn.base import clone
+
+
+
+def _evaluate_grid_point(X, parameters, lens, sorted_lens, interval, overlap, cache = None, distance_matrix = None, return_graph = False, data_key = None):
+    """Build the mapper graph for one interval and overlap combination of a lens and search it for hotspots"""
+
+    # Run a clustering algorithm and build the graph
+    mapper = mapper_algorithm.MapperGraph(data = X,
+                                            lens_function = lens,
+                                            intervals = interval,
+                                            overlap = overlap,
+                                            clustering_algorithm = parameters["clustering_algorithm"],
+                                            text = False,
+                                            sorted_lens = sorted_lens,
+                                            cache = cache,
+                                            distance_matrix = distance_matrix,
+                                            data_key = data_key)
+
+    #build the graph with edges and nodes
+    mapper.build_graph()
+
+    #run hotspot detection
+    hotspot_search = hotspot_algorithm.HotspotSearch(mapper_graph = mapper.graph,
+                                 attribute_function = parameters["attribute_function"],
+                                 samples_in_nodes = mapper.node_membership)
+
+    hotspots = hotspot_search.search_graph(attribute_threshold = parameters["epsilon"],
+                                                min_sample_size = parameters["min_samples"],
+                                                attribute_extreme = parameters["extreme"])
+
+    #return list of samples in each hotspot found
+    sample_list = []
+    for n in hotspots:
+        sample_list.append(utils.sample_index_in_nodes(mapper.node_membership, n))
+
+    result = {"interval": interval,
+              "overlap": overlap,
+              "hotspots": hotspots,
+              "samples": sample_list}
+    if return_graph:
+        result["graph"] = mapper.graph
+        result["node_membership"] = mapper.node_membership
+    return result
+
+
+
+#the search state attached in each worker process of a process pool
+_worker_state = None
+
+
+def _initialise_worker(specs, parameters, cache_bytes, data_key):
+    """Attach the shared dataset and attribute function, and give the worker its own clustering cache"""
+    global _worker_state
+    arrays, blocks = utils.attach_shared_arrays(specs)
+    parameters = dict(parameters, attribute_function = arrays["attribute_function"])
+    cache = mapper_algorithm.ClusteringCache(cache_bytes) if cache_bytes else None
+    _worker_state = {"X": arrays["X"],
+                     "distance_matrix": arrays.get("distance_matrix"),
+                     "parameters": parameters,
+                     "cache": cache,
+                     "data_key": data_key,
+                     "blocks": blocks}
+
+
+def _evaluate_grid_point_in_worker(lens, sorted_lens, interval, overlap, return_graph):
+    return _evaluate_grid_point(_worker_state["X"], _worker_state["parameters"], lens, sorted_lens, interval, overlap,
+                                cache = _worker_state["cache"],
+                                distance_matrix = _worker_state["distance_matrix"],
+                                return_graph = return_graph,
+                                data_key = _worker_state["data_key"])
+
+
+
+class GridExecutor():
+    """Evaluates grid points of the search serially, or fans them out on a thread or process pool.
+    Results are always returned in the order the grid points were given. In a process pool the
+    dataset, attribute function and distance matrix are placed in shared memory, and each worker
+    keeps its own clustering cache. With a clustering cache, the data clustered is hashed once
+    for the whole search rather than for every graph.
+
+    Parameters
+    ----------
+
+    executor : "serial", "thread" or "process", default: ``"serial"``
+        How grid points are evaluated
+
+    n_jobs : int, default: ``None``
+        Number of workers, -1 uses all processors
+        """
+
+    def __init__(self, X, parameters, executor = "serial", n_jobs = None, clustering_cache = None, distance_matrix = None):
+        if executor not in ("serial", "thread", "process"):
+            raise ValueError(f"executor must be 'serial', 'thread' or 'process', not {executor!r}")
+        self.X = X
+        self.parameters = parameters
+        self.executor = executor
+        self.n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+        self.clustering_cache = clustering_cache
+        self.distance_matrix = distance_matrix
+        self._pool = None
+        self._blocks = []
+        self._data_key = None
+
+    def __enter__(self):
+        if self.clustering_cache is not None:
+            self._data_key = self.clustering_cache.data_key(self.distance_matrix if self.distance_matrix is not None else self.X)
+
+        if self.executor == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=self.n_jobs)
+
+        elif self.executor == "process":
+            arrays = {"X": self.X, "attribute_function": np.asarray(self.parameters["attribute_function"])}
+            if self.distance_matrix is not None:
+                arrays["distance_matrix"] = self.distance_matrix
+            specs, self._blocks = utils.share_arrays(arrays)
+            parameters = {k: v for k, v in self.parameters.items() if k not in ("attribute_function", "predefined_lens")}
+            cache_bytes = self.clustering_cache.max_bytes if self.clustering_cache is not None else None
+            self._pool = ProcessPoolExecutor(max_workers=self.n_jobs,
+                                             initializer=_initialise_worker,
+                                             initargs=(specs, parameters, cache_bytes, self._data_key))
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        utils.release_shared_arrays(self._blocks)
+        self._blocks = []
+
+    def map(self, tasks):
+        """Evaluate tasks of (lens, sorted_lens, interval, overlap, return_graph), yielding
+        each result in task order as soon as it and the tasks before it are finished"""
+        if self.executor == "process":
+            return self._pool.map(_evaluate_grid_point_in_worker, *zip(*tasks)) if tasks else iter([])
+
+        evaluate = lambda task, parameters: _evaluate_grid_point(self.X, parameters, *task[:4],
+                                                                 cache = self.clustering_cache,
+                                                                 distance_matrix = self.distance_matrix,
+                                                                 return_graph = task[4],
+                                                                 data_key = self._data_key)
+        if self.executor == "thread":
+            #each thread fits its own clone, the clustering algorithm is refit in place for every interval
+            return self._pool.map(lambda task: evaluate(task, dict(self.parameters, clustering_algorithm = clone(self.parameters["clustering_algorithm"]))), tasks)
+        return map(lambda task: evaluate(task, self.parameters), tasks)
+
+
+
+def _append_checkpoint(path, record):
+    """Append a record to the checkpoint file and flush it to disk"""
+    with open(path, "ab") as f:
+        pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_checkpoint(path):
+    """Read the records of a checkpoint file. A record cut short by a crash is ignored"""
+    records = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                break
+    return records
+
+
+
+class SearchResult():
+    """Snapshot of a search, complete or still running. status is "running", "found" when a
+    lens with hotspots was found, "exhausted" when every lens was searched without hotspots,
+    or "budget" when the search stopped on its time, graph or lens budget (see stop_reason).
+    best is the highest scoring grid point so far as (score, lens number, interval, overlap).
+    parameters and distinct_hotspots hold the lens results merged so far, partial_hotspots the
+    samples of the hotspots at every grid point built so far, keyed by (lens number, interval,
+    overlap), including those of the lens still being searched. hotspot_graphs counts the graphs
+    with hotspots merged by the latest build_graphs or resume call"""
+
+    def __init__(self, status, stop_reason, parameters, parameter_samples, parameter_lens, distinct_hotspots,
+                 best, graphs_built, lenses_searched, elapsed, partial_hotspots = None, hotspot_graphs = None):
+        self.status = status
+        self.stop_reason = stop_reason
+        self.parameters = parameters
+        self.parameter_samples = parameter_samples
+        self.parameter_lens = parameter_lens
+        self.distinct_hotspots = distinct_hotspots
+        self.best = best
+        self.graphs_built = graphs_built
+        self.lenses_searched = lenses_searched
+        self.elapsed = elapsed
+        self.partial_hotspots = partial_hotspots if partial_hotspots is not None else {}
+        self.hotspot_graphs = hotspot_graphs if hotspot_graphs is not None else len(parameters)
+
+    def __repr__(self):
+        return (f"SearchResult(status={self.status!r}, stop_reason={self.stop_reason!r}, hotspot_graphs={self.hotspot_graphs}, "
+                f"graphs_built={self.graphs_built}, lenses_searched={self.lenses_searched}, elapsed={self.elapsed:.1f}s)")
+
+
 
 class Search():
     """This class searches across the Mapper parameters to identify the parameters that build a graph which contains a hotspot
@@ -16,14 +224,158 @@ class Search():
 
     runs: into
         How many times to run the search for a lens
+
+    clustering_cache : mapper.ClusteringCache, default: ``None``
+        Cache of interval clusterings shared by every graph built in the search
+
+    distance_matrix : array, default: ``None``
+        Precomputed pairwise distances between samples (see mapper.pairwise_distance_matrix).
+        Intervals are clustered on its submatrices, so the clustering algorithm must use metric='precomputed'
+
+    executor : "serial", "thread" or "process", default: ``"serial"``
+        Evaluate the interval and overlap grid points on a pool of n_jobs workers (see GridExecutor)
+
+    n_jobs : int, default: ``None``
+        Number of workers for the thread or process pool, -1 uses all processors
+
+    lens_batch_size : int, default: ``1``
+        Number of lenses searched at once. The lenses are still merged in order and the search
+        stops at the first lens with hotspots, so larger batches only add parallel work
+
+    random_state : int, default: ``None``
+        Seed for drawing the random lenses
+
+    checkpoint : str, default: ``None``
+        Path of an append-only checkpoint file. The search settings, the random number generator
+        state, every grid point result and every completed lens are written to it as the search
+        runs, so an interrupted search can be continued with resume
+
+    near_duplicate_threshold : float, default: ``None``
+        Estimated Jaccard similarity (by MinHash) above which a hotspot is treated as the same
+        distinct hotspot as an earlier one. By default only identical sample sets are merged
+
+    survival : tuple of arrays, default: ``None``
+        Survival time and event observed for each sample. If given, every distinct hotspot is
+        scored by a log-rank test against the rest of the cohort when the search finishes
+
+    strategy : search_strategies.SearchStrategy, default: ``GridSearch()``
+        Chooses which interval and overlap combinations of each lens are built, e.g. RandomSearch,
+        CoarseToFine or SuccessiveHalving. The default builds the whole grid
+
+    objective : callable, default: ``search_strategies.hotspot_count``
+        Score of a grid point result that adaptive strategies maximise, e.g. hotspot_size or survival_objective
+
+    time_budget : float, default: ``None``
+        Wall-clock seconds after which the search stops and returns the results so far
+
+    max_graphs : int, default: ``None``
+        Maximum number of mapper graphs built
+
+    max_lenses : int, default: ``None``
+        Maximum number of lenses searched
             """
 
-    def __init__(self, X, runs = 50):
+    def __init__(self, X, runs = 50, clustering_cache = None, distance_matrix = None, executor = "serial", n_jobs = None, lens_batch_size = 1, random_state = None, checkpoint = None, near_duplicate_threshold = None, survival = None, strategy = None, objective = None, time_budget = None, max_graphs = None, max_lenses = None):
         self.X = X
         self.runs = runs
-        self.parameters = {}
-        self.parameter_lens = []
-        self.parameter_samples = {}
+        self.clustering_cache = clustering_cache
+        self.distance_matrix = distance_matrix
+        self.executor = executor
+        self.n_jobs = n_jobs
+        self.lens_batch_size = lens_batch_size
+        self.random_state = random_state
+        self.checkpoint = checkpoint
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.survival = survival
+        self.strategy = strategy if strategy is not None else search_strategies.GridSearch()
+        self.objective = objective if objective is not None else search_strategies.hotspot_count
+        self.time_budget = time_budget
+        self.max_graphs = max_graphs
+        self.max_lenses = max_lenses
+        #progress of the search, read by result() from any thread
+        self._lock = threading.Lock()
+        self.status = "running"
+        self.stop_reason = None
+        self.best = None
+        self.partial_hotspots = {}
+        self.graphs_built = 0
+        self.lenses_searched = 0
+        self._start_time = time.monotonic()
+        self.hotspot_graphs = 0
+        self._reset_results()
+
+    def _reset_results(self):
+        """Clear the hotspots found by an earlier search"""
+        with self._lock:
+            self.parameters = {}
+            self.parameter_lens = []
+            self.parameter_samples = {}
+            #the distinct hotspots found, and the distinct hotspot of each (interval, overlap, hotspot number)
+            self.distinct_hotspots = []
+            self.hotspot_index = {}
+            self._hotspot_fingerprints = {}
+            self._hotspot_signatures = []
+
+    def _register_hotspot(self, grid_point, samples):
+        """Find the distinct hotspot with the same sample set, adding a new one if none matches"""
+        fingerprint = utils.sample_set_fingerprint(samples)
+        hotspot_id = self._hotspot_fingerprints.get(fingerprint)
+
+        #look for a near-duplicate sample set by the similarity of the MinHash signatures
+        signature = utils.minhash_signature(samples)
+        if hotspot_id is None and self.near_duplicate_threshold is not None and self._hotspot_signatures:
+            similarity = (np.array(self._hotspot_signatures) == signature).mean(axis=1)
+            if similarity.max() >= self.near_duplicate_threshold:
+                hotspot_id = int(np.argmax(similarity))
+
+        if hotspot_id is None:
+            hotspot_id = len(self.distinct_hotspots)
+            self.distinct_hotspots.append({"id": hotspot_id,
+                                           "fingerprint": fingerprint,
+                                           "samples": np.asarray(samples),
+                                           "grid_points": []})
+            self._hotspot_signatures.append(signature)
+        self._hotspot_fingerprints.setdefault(fingerprint, hotspot_id)
+
+        self.distinct_hotspots[hotspot_id]["grid_points"].append(grid_point)
+        self.hotspot_index[grid_point] = hotspot_id
+
+    def hotspot_table(self):
+        """Dataframe of the distinct hotspots, with the grid points (interval, overlap, hotspot number) producing each"""
+        return pd.DataFrame([{"size": len(h["samples"]),
+                              "occurrences": len(h["grid_points"]),
+                              "grid_points": h["grid_points"],
+                              "fingerprint": h["fingerprint"],
+                              "logrank": h.get("logrank", np.nan)} for h in self.distinct_hotspots],
+                            columns = ["size", "occurrences", "grid_points", "fingerprint", "logrank"])
+
+    def score_survival(self, durations, event_observed):
+        """Log-rank test of every distinct hotspot against the rest of the cohort, in one batch.
+        The p-value is kept as 'logrank' on each distinct hotspot"""
+        membership = survival_analysis.hotspot_membership_matrix([h["samples"] for h in self.distinct_hotspots], len(durations))
+        results = survival_analysis.logrank_test_batch(membership, durations, event_observed)
+        for hotspot, pvalue in zip(self.distinct_hotspots, results["p_value"]):
+            hotspot["logrank"] = pvalue
+        return self.hotspot_table()
+
+    def _record_grid_result(self, random_lens, result):
+        """Merge the result of one grid point into the search results"""
+        hotspots = result["hotspots"]
+        i_param = result["interval"]
+        o_param = result["overlap"]
+
+        #if hotspot present, save properties
+        if any(hotspots):
+            with self._lock:
+                self.parameters[(i_param,o_param)] = hotspots # list of hotspots
+                self.parameter_lens = {"weights": random_lens["weights"],
+                                        "feature_list": random_lens["feature_list"]}
+                self.parameter_samples[(i_param,o_param)] = result["samples"]
+                self.hotspot_graphs += 1
+
+                #map each hotspot to its distinct sample set
+                for i, samples in enumerate(result["samples"]):
+                    self._register_hotspot((i_param, o_param, i), samples)
 
     def build_graphs(self, parameters, visualise = False):
         """Search through the parameter options and build mapper graphs
@@ -35,75 +387,213 @@ class Search():
             Dictionary of parameter options.
             Must include lens / clustering algorithm / interval list / overlap list / epsilon / minimum sample size / attribute function / hotspot extremity
         """
+        self._reset_results()
+        rng = np.random.default_rng(self.random_state)
+        rng_state = rng.bit_generator.state
+
+        #start a new checkpoint with the settings needed to resume the search
+        if self.checkpoint is not None:
+            with open(self.checkpoint, "wb"):
+                pass
+            _append_checkpoint(self.checkpoint, {"type": "search",
+                                                 "parameters": parameters,
+                                                 "runs": self.runs,
+                                                 "rng_state": rng_state})
+
+        self._search_lenses(parameters, rng, {}, visualise)
+
+        #optional scoring of the hotspots found
+        if self.survival is not None:
+            self.score_survival(*self.survival)
+        return self.result()
+
+    def resume(self, path = None, visualise = False):
+        """Continue a search from its checkpoint. Grid points already in the checkpoint are not
+        rebuilt, and the lenses are redrawn from the saved random number generator state"""
+        if path is not None:
+            self.checkpoint = path
+        records = read_checkpoint(self.checkpoint)
+        settings = records[0]
+        self.runs = settings["runs"]
+
+        rng = np.random.default_rng()
+        rng.bit_generator.state = settings["rng_state"]
+
+        #the grid point results completed before the search stopped
+        completed = {(r["lens"], r["interval"], r["overlap"]): r for r in records if r["type"] == "grid"}
+
+        self._search_lenses(settings["parameters"], rng, completed, visualise)
+
+        #optional scoring of the hotspots found
+        if self.survival is not None:
+            self.score_survival(*self.survival)
+        return self.result()
+
+    def result(self):
+        """Snapshot of the results so far, safe to call from another thread while the search runs"""
+        with self._lock:
+            return SearchResult(status = self.status,
+                                stop_reason = self.stop_reason,
+                                parameters = dict(self.parameters),
+                                parameter_samples = dict(self.parameter_samples),
+                                parameter_lens = dict(self.parameter_lens),
+                                distinct_hotspots = [dict(h) for h in self.distinct_hotspots],
+                                best = self.best,
+                                graphs_built = self.graphs_built,
+                                lenses_searched = self.lenses_searched,
+                                elapsed = time.monotonic() - self._start_time,
+                                partial_hotspots = dict(self.partial_hotspots),
+                                hotspot_graphs = self.hotspot_graphs)
+
+    def _budget_exhausted(self):
+        """Name of the first budget used up, or None while the search may continue"""
+        if self.time_budget is not None and time.monotonic() - self._start_time >= self.time_budget:
+            return "time"
+        if self.max_graphs is not None and self.graphs_built >= self.max_graphs:
+            return "graphs"
+        if self.max_lenses is not None and self.lenses_searched >= self.max_lenses:
+            return "lenses"
+        return None
+
+    def _score_grid_result(self, key, result, scores):
+        """Score a grid point result as it arrives, updating the best point and the partial results"""
+        score = self.objective(result)
+        scores[key[0]][tuple(key[1:])] = score
+        with self._lock:
+            if self.best is None or score > self.best[0]:
+                self.best = (score,) + tuple(key)
+            if result["samples"]:
+                self.partial_hotspots[tuple(key)] = result["samples"]
+
+    def _stop(self, status, reason = None):
+        with self._lock:
+            self.status = status
+            self.stop_reason = reason
+
+    def _search_lenses(self, parameters, rng, completed, visualise):
+        """Search each lens in turn until one contains hotspots or a budget is used up, skipping completed grid points"""
+        with self._lock:
+            self.status = "running"
+            self.stop_reason = None
+            self.best = None
+            self.partial_hotspots = {}
+            self.graphs_built = 0
+            self.lenses_searched = 0
+            self.hotspot_graphs = 0
+            self._start_time = time.monotonic()
 
         #Runs = lens space
         count = 0
-        signficance = False
         print("Building parameters and searching for hotspots")
-        while count < self.runs:
-            if signficance == False:
-                if parameters["predefined_lens"] is None:
-                    #generate a random lens from features
-                    random_lens = linear_lens_combination.Lens(self.X, nonzero_features = parameters["non_zero_lens_features"])
-                else: 
-                    random_lens = parameters["predefined_lens"]
-                    
-                #build a grid of interval and overlap combinations
-                io_list = list(product(parameters["interval_list"], parameters["overlap_list"]))
-
-                #for each grid combination of the interval & overlap, search lens for hotspot
-                for i in io_list:
-                    #define intervals and overlap
-                    i_param = i[0]
-                    o_param = i[1]
-
-                    # Run a clustering algorithm and build the graph
-                    mapper = mapper_algorithm.MapperGraph(data = self.X,
-                                                            lens_function = random_lens["lens"],
-                                                            intervals = i_param,
-                                                            overlap = o_param,
-                                                            clustering_algorithm = parameters["clustering_algorithm"],
-                                                            text = False)
-
-                    #build the graph with edges and nodes
-                    mapper.build_graph()
-
-                    #visualise graph
-                    if visualise == True:
-                        mapper_plot.draw_graph(mapper_graph = mapper.graph,
-                                        attribute_function = parameters["attribute_function"],
-                                        samples_in_nodes = mapper.samples_in_nodes,
-                                        size = 5,
-                                        style = 2,
-                                        labels = False)
-
-                    #run hotspot detection
-                    hotspot_search = hotspot_algorithm.HotspotSearch(mapper_graph = mapper.graph,
-                                                 attribute_function = parameters["attribute_function"],
-                                                 samples_in_nodes = mapper.samples_in_nodes)
-
-                    hotspots = hotspot_search.search_graph(attribute_threshold = parameters["epsilon"],
-                                                                min_sample_size = parameters["min_samples"],
-                                                                attribute_extreme = parameters["extreme"])
-
-                    #return list of samples in each hotspot found
-                    sample_list = []
-                    for n in hotspots:
-                        sample_list.append(utils.sample_index_in_nodes(mapper.samples_in_nodes, n))
-
-
-                    #if hotspot present, save properties
-                    if any(hotspots):
-                        self.parameters[(i_param,o_param)] = hotspots # list of hotspots
-                        self.parameter_lens = {"weights": random_lens["weights"],
-                                                "feature_list": random_lens["feature_list"]}
-                        self.parameter_samples[(i_param,o_param)] = sample_list
-                        significance = True
-
-                #if hotspots exist in the filter function search
-                if self.parameters:
-                    print("\nHotspots search successful")
-                    return
+        if parameters["predefined_lens"] is None:
+            #generate the random lenses from features for every run in one batch
+            random_lenses = linear_lens_combination.Lenses(self.X, self.runs, nonzero_features = parameters["non_zero_lens_features"], random_state = rng)
+        else:
+            random_lenses = [parameters["predefined_lens"]] * self.runs
+
+        #build a grid of interval and overlap combinations
+        io_list = list(product(parameters["interval_list"], parameters["overlap_list"]))
+
+        with GridExecutor(self.X, parameters,
+                          executor = self.executor,
+                          n_jobs = self.n_jobs,
+                          clustering_cache = self.clustering_cache,
+                          distance_matrix = self.distance_matrix) as grid_executor:
+
+            while count < self.runs:
+                if self.max_lenses is not None:
+                    lens_index = range(count, min(count + self.lens_batch_size, self.runs, self.max_lenses))
                 else:
-                    count += 1
-                    print(F"\nCompleted {count} searches")
+                    lens_index = range(count, min(count + self.lens_batch_size, self.runs))
+
+                #sort each lens once, the cover of every grid combination is built from this order
+                sorted_lenses = {l: mapper_algorithm.sort_lens_function(random_lenses[l]["lens"]) for l in lens_index}
+                scores = {l: {} for l in lens_index}
+
+                #the strategy proposes grid points in rounds, until no lens has points left to build
+                stop_reason = None
+                while stop_reason is None:
+                    proposals = {l: self.strategy.propose(io_list, scores[l], l) for l in lens_index}
+                    if not any(proposals.values()):
+                        break
+
+                    tasks = []
+                    task_keys = []
+                    for l in lens_index:
+                        for i_param, o_param in proposals[l]:
+                            if (l, i_param, o_param) not in completed or visualise:
+                                tasks.append((random_lenses[l]["lens"], sorted_lenses[l], i_param, o_param, visualise))
+                                task_keys.append((l, i_param, o_param))
+
+                    #only build the graphs left in the graph budget
+                    if self.max_graphs is not None:
+                        tasks = tasks[:max(self.max_graphs - self.graphs_built, 0)]
+
+                    #for each proposed combination of the interval & overlap, search lens for hotspot
+                    #and checkpoint each result as it arrives
+                    for key, result in zip(task_keys, grid_executor.map(tasks)):
+                        record = {"type": "grid", "lens": key[0], "interval": result["interval"], "overlap": result["overlap"],
+                                  "hotspots": result["hotspots"], "samples": result["samples"]}
+                        if self.checkpoint is not None:
+                            _append_checkpoint(self.checkpoint, record)
+                        completed[key] = dict(record, **result)
+                        with self._lock:
+                            self.graphs_built += 1
+                        self._score_grid_result(key, completed[key], scores)
+                        stop_reason = self._budget_exhausted()
+                        if stop_reason is not None:
+                            break
+
+                    #score the points completed before a resume, a budget may leave some proposals unbuilt
+                    for l in lens_index:
+                        for point in proposals[l]:
+                            key = (l,) + tuple(point)
+                            if key in completed and tuple(point) not in scores[l]:
+                                self._score_grid_result(key, completed[key], scores)
+
+                    if stop_reason is None and self.max_graphs is not None and len(tasks) < len(task_keys):
+                        stop_reason = "graphs"
+
+                #merge the lenses in order, so the results match a serial search
+                for l in lens_index:
+                    random_lens = random_lenses[l]
+                    for i_param, o_param in io_list:
+                        if (i_param, o_param) not in scores[l]:
+                            continue
+                        result = completed[(l, i_param, o_param)]
+                        #visualise graph
+                        if visualise == True:
+                            mapper_plot.draw_graph(mapper_graph = result["graph"],
+                                            attribute_function = parameters["attribute_function"],
+                                            samples_in_nodes = result["node_membership"],
+                                            size = 5,
+                                            style = 2,
+                                            labels = False)
+
+                        self._record_grid_result(random_lens, result)
+
+                    #a lens cut short by a budget is left open in the checkpoint
+                    if self.checkpoint is not None and stop_reason is None:
+                        _append_checkpoint(self.checkpoint, {"type": "lens", "lens": l,
+                                                             "weights": random_lens["weights"],
+                                                             "feature_list": random_lens["feature_list"]})
+
+                    #if hotspots exist in the filter function search
+                    if self.hotspot_graphs:
+                        print("\nHotspots search successful")
+                        self._stop("found", stop_reason)
+                        return
+                    elif stop_reason is None:
+                        count += 1
+                        with self._lock:
+                            self.lenses_searched = count
+                        print(F"\nCompleted {count} searches")
+
+                if stop_reason is None:
+                    stop_reason = self._budget_exhausted()
+                if stop_reason is not None:
+                    print(F"\nSearch stopped, {stop_reason} budget used up")
+                    self._stop("budget", stop_reason)
+                    return
+
+        self._stop("exhausted")
@@ -0,0 +1,133 @@
+"""
+Cached loading of gene expression matrices.
+
+A CSV is parsed once and converted to a binary cache: the values as a .npy array and
+the row and column labels as .npy sidecars. The cache is keyed on a hash of the CSV
+contents, so later loads memory map the values without parsing, and an edited CSV
+is parsed again into a new cache entry. The hash is stored with the size and
+modification time of the CSV and only recomputed when either changes. Entries are
+named after a hash of the absolute path of the CSV, so CSVs with the same file name
+do not share entries, and after the value dtype and read_csv options they were
+written with.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+
+def file_hash(path, chunk_size = 2**24):
+    """Hash of the contents of a file, read in chunks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _settings_hash(dtype, read_csv_kwargs):
+    """Hash of the value dtype and read_csv options a cache entry is written with"""
+    settings = repr((np.dtype(dtype).str, sorted(read_csv_kwargs.items())))
+    return hashlib.blake2b(settings.encode(), digest_size=8).hexdigest()
+
+
+def _cache_entry(path, cache_dir, dtype, read_csv_kwargs):
+    """Directory of the cache entry for the current contents of the CSV and the settings,
+    and the name prefix shared by the entries of the current contents"""
+    path = os.path.abspath(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), ".hotmapper_cache")
+    source_id = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    prefix = F"{os.path.basename(path)}-{source_id}"
+
+    #reuse the hash while the size and modification time of the CSV are unchanged
+    stat = os.stat(path)
+    stamp_path = os.path.join(cache_dir, F"{prefix}.stamp")
+    try:
+        with open(stamp_path) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        stamp = {}
+    if stamp.get("size") == stat.st_size and stamp.get("mtime_ns") == stat.st_mtime_ns:
+        content_hash = stamp["hash"]
+    else:
+        content_hash = file_hash(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(stamp_path, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash}, f)
+
+    entry = os.path.join(cache_dir, F"{prefix}-{content_hash}-{_settings_hash(dtype, read_csv_kwargs)}")
+    return cache_dir, F"{prefix}-{content_hash}", entry
+
+
+def _write_cache(path, entry, dtype, read_csv_kwargs):
+    """Parse the CSV and write its values and labels to the cache entry"""
+    df = pd.read_csv(path, index_col=0, **read_csv_kwargs)
+    values = df.to_numpy(dtype=dtype)
+
+    #write to a temporary directory first, so a partly written entry is never loaded
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    try:
+        np.save(os.path.join(tmp, "values.npy"), values)
+        np.save(os.path.join(tmp, "index.npy"), df.index.to_numpy().astype(str))
+        np.save(os.path.join(tmp, "columns.npy"), df.columns.to_numpy().astype(str))
+        os.replace(tmp, entry)
+    except OSError:
+        #another process wrote the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(entry):
+            raise
+
+
+def _remove_stale_entries(cache_dir, current):
+    """Remove the cache entries of earlier contents of the CSV, keeping the entries of the
+    current contents written with other settings"""
+    prefix = current.rsplit("-", 1)[0] + "-"
+    for other in os.listdir(cache_dir):
+        other_path = os.path.join(cache_dir, other)
+        if other.startswith(prefix) and not other.startswith(current + "-") and os.path.isdir(other_path):
+            shutil.rmtree(other_path, ignore_errors=True)
+
+
+def load_expression(path, cache_dir = None, dtype = np.float64, as_frame = True, **read_csv_kwargs):
+    """Load a numeric CSV with row labels in the first column, through the binary cache.
+
+    Parameters
+    ----------
+
+    path : str
+        CSV file
+
+    cache_dir : str, default: ``None``
+        Directory of the cache, a .hotmapper_cache directory beside the CSV if None
+
+    dtype : numpy dtype, default: ``np.float64``
+        Type of the cached values, e.g. np.float32 to halve the size of the cache
+
+    as_frame : bool, default: ``True``
+        Return a dataframe over the memory mapped values, otherwise the
+        (values, index, columns) arrays
+
+    **read_csv_kwargs
+        Passed to pandas.read_csv when the cache entry is written, each set of options
+        has its own entry
+
+    The values are memory mapped read-only, copy them before modifying them
+    """
+    cache_dir, current, entry = _cache_entry(path, cache_dir, dtype, read_csv_kwargs)
+    if not os.path.isdir(entry):
+        _write_cache(path, entry, dtype, read_csv_kwargs)
+        _remove_stale_entries(cache_dir, current)
+
+    values = np.load(os.path.join(entry, "values.npy"), mmap_mode="r")
+    index = np.load(os.path.join(entry, "index.npy"))
+    columns = np.load(os.path.join(entry, "columns.npy"))
+
+    if not as_frame:
+        return values, index, columns
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
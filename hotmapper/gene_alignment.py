@@ -0,0 +1,95 @@
+"""
+Alignment of the genes shared by several cohorts.
+
+The gene labels of every cohort are hashed once, so the genes shared by any number
+of cohorts, and the position of each shared gene in each cohort, are found in time
+linear in the total number of genes. The alignment map is kept so it can select the
+shared genes from each cohort's data, and translate lens feature indices between
+cohorts, e.g. to apply a discovery lens to a validation cohort.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+
+def _positions_as_slice(positions):
+    """The positions as a slice if they are evenly spaced and increasing, otherwise None"""
+    if len(positions) == 0:
+        return slice(0, 0)
+    if len(positions) == 1:
+        return slice(positions[0], positions[0] + 1)
+    step = positions[1] - positions[0]
+    if step > 0 and np.all(np.diff(positions) == step):
+        return slice(positions[0], positions[-1] + 1, step)
+    return None
+
+
+class GeneAlignment():
+    """Genes shared by several cohorts, in the order of the first cohort, and the
+    position of each shared gene in every cohort
+
+    Parameters
+    ----------
+
+    cohort_genes : dictionary
+        Gene labels of each cohort keyed by cohort name, e.g. the columns of each
+        (patients x genes) dataframe. Gene labels must be unique within a cohort
+        """
+
+    def __init__(self, cohort_genes):
+        if len(cohort_genes) == 0:
+            raise ValueError("GeneAlignment needs at least one cohort")
+        indexes = {name: pd.Index(genes) for name, genes in cohort_genes.items()}
+        for name, index in indexes.items():
+            if not index.is_unique:
+                raise ValueError(F"gene labels of cohort {name} are not unique")
+
+        #hash join each cohort against the genes shared so far
+        names = list(indexes)
+        shared = indexes[names[0]]
+        for name in names[1:]:
+            shared = shared[indexes[name].get_indexer(shared) >= 0]
+
+        self.genes = shared
+        self.positions = {name: index.get_indexer(shared) for name, index in indexes.items()}
+        self._indexes = indexes
+
+    def __len__(self):
+        return len(self.genes)
+
+    def select(self, name, data, axis = 1):
+        """Shared genes of a cohort's data, in the aligned order. data is a dataframe or
+        array with genes along axis. A view is returned when the shared genes are evenly
+        spaced in the cohort, e.g. when it holds only the shared genes in the aligned
+        order, otherwise the selected genes are copied once"""
+        positions = self.positions[name]
+        index = _positions_as_slice(positions)
+        if index is None:
+            index = positions
+
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            return data.iloc[:, index] if axis == 1 else data.iloc[index]
+        data = np.asarray(data) if not isinstance(data, np.ndarray) else data
+        return data[:, index] if axis == 1 else data[index]
+
+    def map_features(self, feature_list, source, target):
+        """Translate gene positions in the source cohort, e.g. a lens feature_list, to the
+        positions of the same genes in the target cohort"""
+        genes = self._indexes[source][np.asarray(feature_list, dtype=int)]
+        target_positions = self._indexes[target].get_indexer(genes)
+        if np.any(target_positions < 0):
+            missing = list(genes[target_positions < 0])
+            raise KeyError(F"genes missing from cohort {target}: {missing[:10]}")
+        return target_positions
+
+    def save(self, filename):
+        """Save the gene labels of every cohort to an npz file, gene labels are stored as strings"""
+        np.savez(filename, **{F"cohort_{i}": np.asarray(index).astype(str) for i, index in enumerate(self._indexes.values())},
+                 names = np.array(list(self._indexes), dtype=str))
+
+    @classmethod
+    def load(cls, filename):
+        """Load an alignment saved with save"""
+        with np.load(filename) as saved:
+            return cls({str(name): saved[F"cohort_{i}"] for i, name in enumerate(saved["names"])})
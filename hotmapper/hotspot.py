@@ -11,7 +11,6 @@ import hotmapper.utils as utils
 
 import numpy as np
 import networkx as nx
-import pandas as pd
 from statsmodels import robust
 from itertools import compress
 from scipy.spatial import distance
@@ -42,11 +41,12 @@ class HotspotSearch:
         #each subgraph needs to be assigned new labels as an new graph, previously contain
         #labels for original mapper. labels retained in nx attributes'_node'
         self.graph = mapper_graph
-        self.samples_in_nodes = samples_in_nodes
+        #the membership is held as a sparse sample x node matrix
+        self.samples_in_nodes = utils.membership_matrix(samples_in_nodes)
 
         #if attribute function provided as values for each sample, average per node
         if len(attribute_function) == samples_in_nodes.shape[0]:
-            self.node_attribute = utils.colour_nodes_by_attribute(samples_in_nodes, attribute_function)
+            self.node_attribute = utils.colour_nodes_by_attribute(self.samples_in_nodes, attribute_function)
 
         elif len(attribute_function) == samples_in_nodes.shape[1]: 
             self.node_attribute = attribute_function
@@ -98,6 +98,21 @@ class HotspotSearch:
 
 
 
+    def _single_linkage_matrix(self, subgraph, edge_weights_sorted):
+        """Single linkage matrix of the connected nodes, used to plot the dendrogram. Nodes
+        without an edge between them are placed at distance 1"""
+        nodes = list(subgraph.nodes)
+        position = {node: i for i, node in enumerate(nodes)}
+        a = np.ones((len(nodes), len(nodes)))
+        np.fill_diagonal(a, 0.0)
+        for (u,v), w in edge_weights_sorted.items():
+            a[position[u], position[v]] = w
+            a[position[v], position[u]] = w
+
+        dists = distance.squareform(a)
+        return hierarchy.linkage(dists)
+
+
     def _identify_edge_cut_off(self, subgraph, edge_weights, plot_dendrogram = False):
         """ Define edge weights according to the difference in attribute value between nodes.
             Sort the edge weights, then identify the cut-off point to build the clusters - between the
@@ -111,34 +126,17 @@ class HotspotSearch:
         else:
             #return the edge weights found in the new subgraph
             edge_weights_sorted = self._sort_subgraph_edge_weights(subgraph, edge_weights)
-            #empty matrix of node length x needed for linkage tree
-            a = pd.DataFrame(1.0, index= subgraph.nodes, columns=subgraph.nodes)
-
-            #construct matrix of nodes and edges
-            for i,j in edge_weights_sorted.items():
-                u = i[0]
-                v = i[1]
-                a.loc[u,v] = j
-                a.loc[v,u] = j
-                a.loc[u,u] = 0.0
-                a.loc[v,v] = 0.0
-
-            #construct a single linkage matrix of connected node
-            dists = distance.squareform(a)
-            Z = hierarchy.linkage(dists)
-            
+
             #retain the threshold for edge cutoff and get the edge weight values from the dict
             #find the differences between all the values. We ignore the very last value
-            edge_differences = list(edge_weights_sorted.values())
-            edge_difference_distances = [j-i for i, j in zip(edge_differences[:-2], edge_differences[1:])]
+            edge_differences = np.fromiter(edge_weights_sorted.values(), dtype=float)
+            edge_difference_distances = np.diff(edge_differences[:-1])
 
             #find the maximum difference and the index
-            try:
-                m = max(edge_difference_distances)
-                max_index = edge_difference_distances.index(m)
-                cut_index = max_index
-
-            except ValueError:
+            if len(edge_difference_distances):
+                cut_index = int(np.argmax(edge_difference_distances))
+                m = edge_difference_distances[cut_index]
+            else:
                 m = 0
                 cut_index = 0
 
@@ -150,6 +148,9 @@ class HotspotSearch:
 
 
             if plot_dendrogram == True:
+                #construct a single linkage matrix of connected node, only needed for the plot
+                Z = self._single_linkage_matrix(subgraph, edge_weights_sorted)
+
                 #specify the nodes contained in this subgraph
                 lab = list(subgraph.nodes())
                 graph_colours = {i:v for i,v in enumerate(self.node_attribute)}
@@ -179,25 +180,34 @@ class HotspotSearch:
 
     def _identify_attribute_clusters_below_cutoff(self, subgraph, edge_weights, cutoff):
         """Function seperates the graph into clusters according to the edge
-        weight cutoff point. Any edges above this threshold are removed, leaving
-        a graph seperated into groups of similar node values"""
+        weight cutoff point. Nodes joined by edges below this threshold are merged
+        (single linkage by union-find), leaving a graph seperated into groups of similar node values"""
 
         #return the edge weights found in the new subgraph
         edge_weights_sorted = self._sort_subgraph_edge_weights(subgraph, edge_weights)
 
-        #make a copy of the original subgraph
-        graph_copy = subgraph.copy()
-
-        #identify the any edges above the cut-off
-        remove_edges = [i for i in edge_weights_sorted if edge_weights_sorted[i] > cutoff]
-
-        #remove these values from the graph
-        for e1,e2 in remove_edges:
-            graph_copy.remove_edge(e1,e2)
-
-        #map between the old and new labels
-        communities = self._seperate_graph_connected_components(graph_copy)
-        cluster_nodes = [list(cluster.nodes) for cluster in list(communities.values())]
+        #each node starts in its own cluster
+        parent = {node: node for node in subgraph.nodes}
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        #join the nodes of any edges that are not above the cut-off
+        for (u,v), w in edge_weights_sorted.items():
+            if w > cutoff:
+                continue
+            root_u, root_v = find(u), find(v)
+            if root_u != root_v:
+                parent[root_v] = root_u
+
+        #group the nodes by cluster, keeping the node order of the subgraph
+        clusters = {}
+        for node in subgraph.nodes:
+            clusters.setdefault(find(node), []).append(node)
+        cluster_nodes = list(clusters.values())
         
         return(cluster_nodes)
 
@@ -212,7 +222,25 @@ class HotspotSearch:
 
     def _find_no_samples_in_nodes(self, nodes):
         """Function finds the sample size for specified nodes in the Mapper graph"""
-        return np.sum(self.samples_in_nodes[nodes].max(axis=1))
+        return len(utils.samples_in_node_list(self.samples_in_nodes, nodes))
+
+
+    def _component_statistics(self, component):
+        """Precompute the sample coverage and attribute sums of a graph component, so the
+        statistics of any cluster and its neighbourhood follow from set algebra over the component"""
+        nodes = list(component)
+        membership = self.samples_in_nodes[:, nodes]
+
+        #restrict to the samples found in this component, with a row of samples for each node
+        samples = np.unique(membership.indices)
+        node_samples = membership[samples, :].T.toarray()
+
+        attribute = np.array([self.node_attribute[n] for n in nodes], dtype=float)
+        return {"position": {n: i for i, n in enumerate(nodes)},
+                "node_samples": node_samples,
+                "coverage": node_samples.sum(axis=0, dtype=np.int32),
+                "attribute": attribute,
+                "attribute_sum": attribute.sum()}
 
 
     def _cluster_classification(self, subgraph, community_clusters, attribute_threshold, min_sample_size = 30, attribute_extreme = "either"):
@@ -220,23 +248,24 @@ class HotspotSearch:
         hotspot = {}
         hotspot_class = [True]*len(community_clusters)
 
-        #find all the nodes in this graph community
+        #find all the nodes in this graph community, and their sample and attribute totals
         component = subgraph.nodes
+        stats = self._component_statistics(component)
 
         for i,cluster in enumerate(community_clusters):
-
-            #find neighbour nodes - the other remaining nodes in the component
-        #    print(f"cluster {list(cluster)}")
-            neighbour = list(np.setdiff1d(component, cluster))
+            #the neighbour nodes are the other remaining nodes in the component
+            index = [stats["position"][n] for n in cluster]
+            neighbour_size = len(component) - len(index)
 
             #find mean attribute values of cluster and neighbour
-            cluster_mean_attribute = self._find_attribute_value_of_node_cluster(cluster)
-            neighbour_mean_attribute = self._find_attribute_value_of_node_cluster(neighbour)
-        #    print(f"mean attribute: \nhotspot {cluster_mean_attribute} neighbours {neighbour_mean_attribute}\n ")
-            #find sample size of cluster and neighbour
-            cluster_sample_size = self._find_no_samples_in_nodes(cluster)
-            neighbour_sample_size = self._find_no_samples_in_nodes(neighbour)
-        #    print(f"mean size: \nhotspot {cluster_sample_size} neighbours {neighbour_sample_size}\n ")
+            cluster_attribute_sum = stats["attribute"][index].sum()
+            cluster_mean_attribute = round(cluster_attribute_sum / len(index), 3)
+            neighbour_mean_attribute = round((stats["attribute_sum"] - cluster_attribute_sum) / neighbour_size, 3) if neighbour_size else np.nan
+
+            #find sample size of cluster and neighbour, a neighbour sample is covered by a node outside the cluster
+            cluster_coverage = stats["node_samples"][index].sum(axis=0, dtype=np.int32)
+            cluster_sample_size = np.count_nonzero(cluster_coverage)
+            neighbour_sample_size = np.count_nonzero(stats["coverage"] - cluster_coverage)
 
             # CHECK 1 - Size of samples in the cluster is sufficiently larger than threshold
             if cluster_sample_size < min_sample_size:
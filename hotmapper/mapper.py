@@ -4,6 +4,14 @@ import pandas as pd
 import sklearn.cluster as sklc
 from sklearn import manifold, decomposition
 import networkx as nx
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.metrics import pairwise_distances
 
 #supporting python scripts
 import hotmapper.utils as utils
@@ -16,39 +24,89 @@ from scipy.spatial import distance
 
 
 
-def _build_cover_on_lens_function(data, lens_function, intervals, overlap):
+def sort_lens_function(lens_function):
+    """Sort the lens once so the cover can be built for any number of intervals and
+    overlap. Returns the sample order and the sorted lens values"""
+    lens_function = np.asarray(lens_function)
+    lens_order = np.argsort(lens_function, kind="stable")
+    lens_sorted = lens_function[lens_order]
+    return lens_order, lens_sorted
+
+
+def _build_cover_on_lens_function(data, lens_function, intervals, overlap, sorted_lens = None):
     """Build a cover by dividing the lens into overlapping intervals and retrieve
-    the samples contained in each interval"""
+    the samples contained in each interval. The samples in each interval are views
+    into the sorted lens order, in ascending lens value"""
+
+    #sort the lens unless the sorted order has been computed already
+    if sorted_lens is None:
+        sorted_lens = sort_lens_function(lens_function)
+    lens_order, lens_sorted = sorted_lens
 
     #find the range of the lens function
-    lens_min = np.amin(lens_function)
-    lens_max = np.amax(lens_function)
+    lens_min = lens_sorted[0]
+    lens_max = lens_sorted[-1]
 
     #calculate the size of each interval
     interval_length = (lens_max - lens_min) / (((intervals-1)  *  (1 - overlap)) + 1)
 
-    #the number of samples in the dataset
-    no_samples_in_data = np.array(range(data.shape[0]))
+    #the starting point of each interval is the start of the lens function
+    a = lens_min + (np.arange(intervals) * interval_length) * (1 - overlap)
+    b = a + interval_length
+    interval_sets = [[ai,bi] for ai, bi in zip(a, b)]
 
-    #these are the fundamental properties of the intervals
-    interval_samples = [False for i in range(intervals)]
-    samples_in_interval = {}
-    interval_sets = []
+    #a point is assigned to an interval if its function value lies between
+    #the interval start and end points, so each interval is a slice of the sorted lens
+    start = np.searchsorted(lens_sorted, a, side="left")
+    end = np.searchsorted(lens_sorted, b, side="right")
+    samples_in_interval = {i: lens_order[start[i]:end[i]] for i in range(intervals)}
 
-    for i in range (0, intervals):
-        #the starting point of each interval is the start of the lens function
-        ai = lens_min + (i * interval_length) * (1 - overlap)
-        bi = ai + interval_length
-        interval_sets.append([ai,bi])
-        #for each point, assign it to an interval if the function value
-        #of this point lies between interval start and end points
-        points_in_set = ((ai <= lens_function) & (lens_function <= bi))
-        samples = no_samples_in_data[points_in_set]
-        samples_in_interval[i] = np.unique(samples)
+    return samples_in_interval, interval_sets
 
 
-    return samples_in_interval, interval_sets
 
+def _distance_key(data, metric):
+    """Hash of the data and the distance metric a distance matrix was computed from"""
+    h = hashlib.blake2b(digest_size=16)
+    data = np.ascontiguousarray(data)
+    h.update(str((data.shape, data.dtype.str)).encode())
+    h.update(data.data)
+    h.update(repr(metric).encode())
+    return h.hexdigest()
+
+
+def pairwise_distance_matrix(data, metric = "euclidean", block_size = 1024, filename = None):
+    """Compute the full pairwise distance matrix of the samples once, as float32, for clustering
+    intervals with metric='precomputed' estimators. Rows are computed in blocks of block_size.
+    If a filename is given the matrix is written to a memory-mapped .npy file, with a hash of the
+    data and metric in a .key file beside it. An existing file is loaded instead of recomputed
+    when the hash matches"""
+    n = data.shape[0]
+    key = _distance_key(data, metric)
+    if filename is not None and os.path.exists(filename) and os.path.exists(filename + ".key"):
+        with open(filename + ".key") as f:
+            saved_key = f.read().strip()
+        if saved_key == key:
+            return np.load(filename, mmap_mode="r")
+
+    if filename is None:
+        distances = np.empty((n, n), dtype=np.float32)
+    else:
+        #remove the key first, so an interrupted computation is never reused
+        if os.path.exists(filename + ".key"):
+            os.remove(filename + ".key")
+        distances = np.lib.format.open_memmap(filename, mode="w+", dtype=np.float32, shape=(n, n))
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        distances[start:stop] = pairwise_distances(data[start:stop], data, metric=metric)
+
+    if filename is not None:
+        distances.flush()
+        with open(filename + ".key", "w") as f:
+            f.write(key)
+        distances = np.load(filename, mmap_mode="r")
+    return distances
 
 
 def _minimum_samples_for_clustering_algorithm(clustering_algorithm):
@@ -66,39 +124,231 @@ def _minimum_samples_for_clustering_algorithm(clustering_algorithm):
 
 
 
-def _cluster_data_in_intervals(data, intervals, clustering_algorithm, samples_in_interval):
+#the data matrix attached from shared memory in each worker process
+_shared_data = None
+_shared_blocks = None
+
+
+def _attach_shared_data(specs):
+    """Initialise a worker process with a view of the data held in shared memory"""
+    global _shared_data, _shared_blocks
+    arrays, _shared_blocks = utils.attach_shared_arrays(specs)
+    _shared_data = arrays["data"]
+
+
+def _interval_points(data, samples, precomputed = False):
+    """The points clustered in an interval, or the submatrix of pairwise distances between them"""
+    if precomputed:
+        return np.asarray(data[np.ix_(samples, samples)], dtype=np.float64)
+    return data[samples]
+
+
+def _fit_interval_labels(clustering_algorithm, samples, data = None, precomputed = False):
+    """Fit a clone of the clustering algorithm to the samples in one interval and return the labels.
+    Inside a worker process the data is read from shared memory"""
+    if data is None:
+        data = _shared_data
+    return clone(clustering_algorithm).fit(_interval_points(data, samples, precomputed)).labels_
+
+
+def _fit_intervals_in_parallel(data, clustering_algorithm, interval_samples, n_jobs, executor, precomputed = False):
+    """Cluster the samples of every interval on a thread or process pool, returning the labels in interval order"""
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    estimators = [clustering_algorithm] * len(interval_samples)
+    precomputed = [precomputed] * len(interval_samples)
+
+    if executor == "thread":
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            return list(pool.map(_fit_interval_labels, estimators, interval_samples, [data] * len(interval_samples), precomputed))
+
+    elif executor == "process":
+        #place the data in shared memory so it is not pickled to every worker
+        specs, blocks = utils.share_arrays({"data": data})
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=_attach_shared_data,
+                                     initargs=(specs,)) as pool:
+                return list(pool.map(_fit_interval_labels, estimators, interval_samples, [None] * len(interval_samples), precomputed))
+        finally:
+            utils.release_shared_arrays(blocks)
+
+    else:
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor!r}")
+
+
+class ClusteringCache():
+    """Least recently used cache of the clustering labels found in each interval. Intervals
+    are keyed by a hash of their sorted sample indexes, the clustering parameters and the data,
+    so graphs built over an interval/overlap grid reuse the fits of repeated intervals.
+
+    Parameters
+    ----------
+
+    max_bytes : int, default: ``256 MB``
+        Memory budget for the stored labels, the least recently used are evicted beyond it
+        """
+
+    def __init__(self, max_bytes = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._labels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._labels)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def data_key(self, data):
+        """Hash of the data, computed once and passed to clustering_key for every graph built on the data"""
+        h = hashlib.blake2b(digest_size=16)
+        data = np.ascontiguousarray(data)
+        h.update(str((data.shape, data.dtype.str)).encode())
+        h.update(data.data)
+        return h.hexdigest()
+
+    def clustering_key(self, data, clustering_algorithm, data_key = None):
+        """Hash of the data and the clustering settings, shared by every interval of a graph.
+        The data is only hashed if its data_key is not given"""
+        if data_key is None:
+            data_key = self.data_key(data)
+        h = hashlib.blake2b(data_key.encode(), digest_size=16)
+        h.update(type(clustering_algorithm).__qualname__.encode())
+        h.update(repr(sorted(clustering_algorithm.get_params(deep=False).items())).encode())
+        return h.hexdigest()
+
+    def interval_key(self, clustering_key, samples):
+        """Hash of the sorted samples in an interval, combined with the clustering key"""
+        h = hashlib.blake2b(np.ascontiguousarray(samples, dtype=np.int64).data, digest_size=16)
+        return (clustering_key, h.hexdigest())
+
+    def get(self, key):
+        with self._lock:
+            labels = self._labels.get(key)
+            if labels is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._labels.move_to_end(key)
+            return labels
+
+    def put(self, key, labels):
+        labels = np.array(labels)
+        with self._lock:
+            if key in self._labels:
+                return
+            self._labels[key] = labels
+            self.nbytes += labels.nbytes
+            #evict the least recently used labels until within budget
+            while self.nbytes > self.max_bytes and self._labels:
+                _, evicted = self._labels.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._labels.clear()
+            self.nbytes = 0
+
+
+def _cluster_data_in_intervals(data, intervals, clustering_algorithm, samples_in_interval, n_jobs = None, executor = "process", cache = None, distance_matrix = None, data_key = None):
     """Perform clustering within each interval on the data in the original space.
     These clusters form nodes in the graph, and overlapping clusters are reperesented
-    by edges. """
+    by edges. If n_jobs is set, the intervals are clustered in parallel on cloned estimators.
+    If a ClusteringCache is given, intervals already clustered are not refit, data_key is the cache
+    data_key of the data clustered (the distance matrix if given) when already computed. If a distance
+    matrix is given, each interval is clustered on its submatrix with a metric='precomputed' estimator"""
+
+    #cluster on slices of the pairwise distances rather than the data
+    precomputed = distance_matrix is not None
+    if precomputed:
+        data = distance_matrix
 
     cluster_samples_in_interval = {}
-    n = 0 #n is the number of clusters at the start
-    n_i = 0 # n_i is the number of clusters generated in that interval set
     min_samples_in_cluster = _minimum_samples_for_clustering_algorithm(clustering_algorithm)
-    #for each interval, if there is more than two data points in that interval
-    #Fit a clustering algorithm to those datapoints
-    for i in range(0, intervals):
-        #access the unique samples within each interval
-        samples = samples_in_interval[i]
-        points =  data[samples]
 
-        #THIS SETS THE MIMINMUM NUMBER OF SAMPLES IN A NODE - we lose intervals if we do not incorporate nodes
+    #access the unique samples within each interval, in sample order
+    #THIS SETS THE MIMINMUM NUMBER OF SAMPLES IN A NODE - we lose intervals if we do not incorporate nodes
+    interval_samples = {}
+    for i in range(0, intervals):
+        samples = np.sort(samples_in_interval[i])
         if len(samples) > min_samples_in_cluster:
-            cl = clustering_algorithm.fit(points)
-            c_i = [samples[np.where(cl.labels_ == label)] for label in set(cl.labels_)]
-            cluster_samples_in_interval[i] = c_i
-        n =  n + n_i
+            interval_samples[i] = samples
+
+    #look up the intervals that have been clustered before
+    interval_labels = {}
+    if cache is not None:
+        clustering_key = cache.clustering_key(data, clustering_algorithm, data_key)
+        interval_keys = {i: cache.interval_key(clustering_key, samples) for i, samples in interval_samples.items()}
+        for i in interval_samples:
+            labels = cache.get(interval_keys[i])
+            if labels is not None:
+                interval_labels[i] = labels
+    to_fit = [i for i in interval_samples if i not in interval_labels]
+
+    #for each interval, if there is more than two data points in that interval
+    #Fit a clustering algorithm to those datapoints
+    if n_jobs is None or n_jobs == 1:
+        fitted_labels = [clustering_algorithm.fit(_interval_points(data, interval_samples[i], precomputed)).labels_ for i in to_fit]
+    else:
+        fitted_labels = _fit_intervals_in_parallel(data, clustering_algorithm, [interval_samples[i] for i in to_fit], n_jobs, executor, precomputed)
+
+    for i, labels in zip(to_fit, fitted_labels):
+        interval_labels[i] = labels
+        if cache is not None:
+            cache.put(interval_keys[i], labels)
+
+    for i, samples in interval_samples.items():
+        labels = interval_labels[i]
+        c_i = [samples[np.where(labels == label)] for label in set(labels)]
+        cluster_samples_in_interval[i] = c_i
     return cluster_samples_in_interval
 
 
-#
 def _convert_sampleID_dict_to_matrix(data, ID_dictionary):
-    mtx = pd.DataFrame(0, index=np.arange(len(data)), columns=ID_dictionary.keys())
-    for node in ID_dictionary:
-        node_columns = mtx[node]
-        samples = ID_dictionary[node]
-        node_columns[samples] = 1
-    return mtx
+    """Convert a dictionary of sample indexes to a sparse boolean membership matrix,
+    with samples in rows and the dictionary keys in columns"""
+    sample_lists = [np.sort(ID_dictionary[k]) for k in ID_dictionary]
+    indptr = np.zeros(len(sample_lists) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(samples) for samples in sample_lists])
+    if sample_lists:
+        indices = np.concatenate(sample_lists).astype(np.int64)
+    else:
+        indices = np.array([], dtype=np.int64)
+    values = np.ones(len(indices), dtype=bool)
+    return sparse.csc_matrix((values, indices, indptr), shape=(len(data), len(sample_lists)))
+
+
+def _convert_matrix_to_dataframe(membership):
+    """Dense dataframe view of a membership matrix, with binary values indicating
+    the presence of a sample in each column"""
+    return pd.DataFrame(membership.toarray().astype(np.int64), index=np.arange(membership.shape[0]))
+
+
+def _build_edges_from_membership(node_membership):
+    """Find every pair of nodes sharing samples from the node co-membership matrix.
+    Returns the edges (u < v, sorted) with the number of shared samples as weight"""
+    membership = node_membership.astype(np.int32)
+    shared = sparse.triu(membership.T @ membership, k=1, format="csr")
+    shared.sort_indices()
+    shared = shared.tocoo()
+    return list(zip(shared.row.tolist(), shared.col.tolist(), shared.data.tolist()))
 
 
 def _build_cluster_index_labels(samples_in_clusters):
@@ -134,7 +384,7 @@ class MapperGraph():
             """
 
 
-    def __init__(self, data, lens_function, intervals, overlap, clustering_algorithm, text = True):
+    def __init__(self, data, lens_function, intervals, overlap, clustering_algorithm, text = True, sorted_lens = None, n_jobs = None, executor = "process", cache = None, distance_matrix = None, data_key = None):
 
         self.data = data
         self.lens_function = lens_function
@@ -142,6 +392,17 @@ class MapperGraph():
         self.overlap = overlap
         self.clustering_algorithm = clustering_algorithm
         self.text = text
+        #the sorted lens can be shared between graphs built on the same lens function
+        self.sorted_lens = sorted_lens
+        #clustering in each interval runs on a pool of n_jobs workers ("process" or "thread") if set
+        self.n_jobs = n_jobs
+        self.executor = executor
+        #a ClusteringCache shared between graphs avoids refitting repeated intervals
+        self.cache = cache
+        #the cache data_key of the data (or distance matrix), so graphs built on the same data hash it once
+        self.data_key = data_key
+        #optional precomputed pairwise distances between samples, see pairwise_distance_matrix
+        self.distance_matrix = distance_matrix
 
         if self.text == True:
             print("Initializing Mapper class...")
@@ -156,11 +417,11 @@ class MapperGraph():
 
         if self.text == True:
             print("Build cover...")
-        samples_in_intervals, interval_sets = _build_cover_on_lens_function(self.data, self.lens_function, self.intervals, self.overlap)
+        samples_in_intervals, interval_sets = _build_cover_on_lens_function(self.data, self.lens_function, self.intervals, self.overlap, self.sorted_lens)
 
         if self.text == True:
             print("Build clusters...")
-        samples_in_clusters = _cluster_data_in_intervals(self.data, self.intervals, self.clustering_algorithm, samples_in_intervals)
+        samples_in_clusters = _cluster_data_in_intervals(self.data, self.intervals, self.clustering_algorithm, samples_in_intervals, self.n_jobs, self.executor, self.cache, self.distance_matrix, self.data_key)
 
         #networkx graph class
         G = nx.Graph()
@@ -191,35 +452,40 @@ class MapperGraph():
 
 
 
-        #to build an edge check for overlapping samples between neighbouring nodes
-        #define the key list to iterate through dict and check neighbouring intervals
-        keyList=sorted(samples_in_clusters.keys())
-        for i, l in enumerate(keyList[:-1]):
-            l_neighbour = keyList[i+1]
-            cluster_points = samples_in_clusters[l]
-            cluster_points_neighbour = samples_in_clusters[l_neighbour]
-
-            for cluster_label, main_cluster in enumerate(cluster_points):
-                for cluster_label_neighbour, neighbour_cluster in enumerate(cluster_points_neighbour):
-                    #if any points in the main cluster being check are in the neighbouring cluster
-                    if any(point in main_cluster for point in neighbour_cluster):
-                        G.add_edge(node_dict[(l,cluster_label)], node_dict[(l_neighbour,cluster_label_neighbour)])
-
-
         #convert samples_in_node from dict with node in keys and samples in values,
-        #to df with nodes in columns and samples in rows and binary values indicating the presence of sample in node
-        #def convert_index_dict_to_matrix():
-        interval_clusters = _convert_sampleID_dict_to_matrix(self.data, samples_in_intervals)
-        node_clusters = _convert_sampleID_dict_to_matrix(self.data, samples_in_node)
-
-
+        #to a sparse matrix with nodes in columns and samples in rows indicating the presence of sample in node
+        interval_membership = _convert_sampleID_dict_to_matrix(self.data, samples_in_intervals)
+        node_membership = _convert_sampleID_dict_to_matrix(self.data, samples_in_node)
 
+        #an edge is built between any two nodes with overlapping samples, including nodes in
+        #non-adjacent intervals when the overlap is above 0.5. The number of shared samples is kept on the edge
+        G.add_weighted_edges_from(_build_edges_from_membership(node_membership), weight = "shared_samples")
 
         self.graph = G
-        self.samples_in_nodes = node_clusters
+        self.node_membership = node_membership
         self.node_count_in_intervals = node_count_in_intervals
         self.nodes_in_intervals = nodes_in_intervals
-        self.samples_in_intervals = interval_clusters
+        self.interval_membership = interval_membership
         self.interval_sets = interval_sets
 
+        #dense views are only built on request
+        self._samples_in_nodes = None
+        self._samples_in_intervals = None
+
         return G
+
+
+    @property
+    def samples_in_nodes(self):
+        """Dataframe with nodes in columns and samples in rows, built from node_membership"""
+        if self._samples_in_nodes is None:
+            self._samples_in_nodes = _convert_matrix_to_dataframe(self.node_membership)
+        return self._samples_in_nodes
+
+
+    @property
+    def samples_in_intervals(self):
+        """Dataframe with intervals in columns and samples in rows, built from interval_membership"""
+        if self._samples_in_intervals is None:
+            self._samples_in_intervals = _convert_matrix_to_dataframe(self.interval_membership)
+        return self._samples_in_intervals
@@ -69,7 +69,7 @@ class Parameter_Search():
                     if visualise == True:
                         hmv.draw_graph(mapper_graph = mapper.graph,
                                         attribute_function = parameters["attribute_function"],
-                                        samples_in_nodes = mapper.samples_in_nodes,
+                                        samples_in_nodes = mapper.node_membership,
                                         size = 5,
                                         style = 2,
                                         labels = False)
@@ -77,7 +77,7 @@ class Parameter_Search():
                     #run hotspot detection
                     hotspot_search = hmh.HotSpot(mapper_graph = mapper.graph,
                                                  attribute_function = parameters["attribute_function"],
-                                                 samples_in_nodes = mapper.samples_in_nodes)
+                                                 samples_in_nodes = mapper.node_membership)
 
                     hotspots = hotspot_search.search_graph(attribute_threshold = parameters["epsilon"],
                                                                 min_sample_size = parameters["min_samples"],
@@ -86,7 +86,7 @@ class Parameter_Search():
                     #return list of samples in each hotspot found
                     sample_list = []
                     for n in hotspots:
-                        sample_list.append(hmu.sample_index_in_nodes(mapper.samples_in_nodes, n))
+                        sample_list.append(hmu.sample_index_in_nodes(mapper.node_membership, n))
 
 
                     #if hotspot present, save properties
@@ -6,6 +6,7 @@ Created on Fri Sep 25 13:01:17 2020
 """
 
 import numpy as np
+from scipy import sparse
 
 
 def Lens(data, nonzero_features = None, weights = None, feature_list = None, weight_range = [-1,1]):
@@ -29,20 +30,40 @@ def Lens(data, nonzero_features = None, weights = None, feature_list = None, wei
         nonzero_features = total_features
         
     
-    #for each sample in the dataset calculate the lens function 
-    lens = np.zeros(total_samples)
-    
-    #for each vector in the dataset
-    for v in range(total_samples):
-        x = data[v,:]
-    
-        for k in range(nonzero_features):
-            feature_i = feature_list[k]
-            #find the sum of all features x random
-            lens[v] += x[feature_i] * weights[k]
+    #for each sample in the dataset calculate the lens function as the 
+    #sum of the selected features x random weights
+    features = np.asarray(feature_list, dtype=int)[:nonzero_features]
+    lens = data[:, features] @ np.asarray(weights, dtype=float)[:nonzero_features]
             
     lens_settings = {"lens": lens,
                     "weights": weights,
                     "feature_list": feature_list}
     
     return lens_settings
+
+
+def Lenses(data, n_lenses, nonzero_features, weight_range = [-1,1], random_state = None):
+    """Return n_lenses random linear combinations of a subset of features, evaluated together
+    as one product of the data with a sparse (features x n_lenses) weight matrix. Each lens
+    has the same settings as returned by Lens. random_state is a seed or numpy Generator"""
+
+    total_samples, total_features = data.shape
+    rng = np.random.default_rng(random_state)
+
+    #randomly select the subset of features and their corresponding weights for each lens
+    feature_lists = []
+    weight_lists = []
+    for i in range(n_lenses):
+        feature_lists.append(rng.choice(total_features, nonzero_features, replace=False))
+        weight_lists.append(rng.uniform(low=weight_range[0], high=weight_range[1], size=nonzero_features))
+
+    #sparse weight matrix with a column of weights for each lens
+    W = sparse.csc_matrix((np.array(weight_lists, dtype=float).reshape(-1),
+                           np.array(feature_lists, dtype=int).reshape(-1),
+                           np.arange(n_lenses + 1) * nonzero_features),
+                          shape=(total_features, n_lenses))
+    lenses = np.asarray((W.T @ np.asarray(data).T).T)
+
+    return [{"lens": lenses[:, k],
+             "weights": weight_lists[k],
+             "feature_list": feature_lists[k]} for k in range(n_lenses)]
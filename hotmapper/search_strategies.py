@@ -0,0 +1,169 @@
+"""
+Strategies for choosing which interval and overlap combinations of a lens to build.
+
+A strategy proposes grid points in rounds. After each round the proposed points are
+built and searched for hotspots, and each result is scored by an objective (higher is
+better). The strategy then proposes the next round from the scores so far, and the
+lens is finished when it proposes nothing new.
+"""
+
+from abc import ABC, abstractmethod
+import numpy as np
+import hotmapper.survival as survival_analysis
+
+
+
+#---------------------------objectives--------------------------------#
+def hotspot_count(result):
+    """Number of hotspots found in the graph"""
+    return len(result["hotspots"])
+
+
+def hotspot_size(result):
+    """Number of samples in the largest hotspot found in the graph"""
+    return max([len(samples) for samples in result["samples"]], default=0)
+
+
+def survival_objective(durations, event_observed):
+    """Objective scoring a graph by -log10 of the smallest log-rank p-value of its hotspots"""
+    def objective(result):
+        if not result["samples"]:
+            return 0.0
+        membership = survival_analysis.hotspot_membership_matrix(result["samples"], len(durations))
+        p_values = survival_analysis.logrank_test_batch(membership, durations, event_observed)["p_value"]
+        return float(-np.log10(max(np.nanmin(p_values), 1e-300)))
+    return objective
+
+
+
+#---------------------------strategies--------------------------------#
+class SearchStrategy(ABC):
+    """Common interface of the search strategies. propose returns the grid points to build
+    next for a lens, given the grid of (interval, overlap) points and the scores of the
+    points built so far. An empty list ends the search of that lens"""
+
+    @abstractmethod
+    def propose(self, grid, scores, lens_index):
+        pass
+
+    def _neighbours(self, grid, point, radius):
+        """Grid points within radius steps of the point along the interval and overlap options"""
+        intervals = sorted({i for i, o in grid})
+        overlaps = sorted({o for i, o in grid})
+        i, o = intervals.index(point[0]), overlaps.index(point[1])
+        grid_set = set(grid)
+        return [p for p in ((intervals[a], overlaps[b])
+                            for a in range(max(i - radius, 0), min(i + radius + 1, len(intervals)))
+                            for b in range(max(o - radius, 0), min(o + radius + 1, len(overlaps))))
+                if p in grid_set]
+
+
+class GridSearch(SearchStrategy):
+    """Build every grid point, the exhaustive search"""
+
+    def propose(self, grid, scores, lens_index):
+        return [] if scores else list(grid)
+
+
+class RandomSearch(SearchStrategy):
+    """Build a random sample of budget grid points
+
+    Parameters
+    ----------
+
+    budget : int or float
+        Number of grid points, or the fraction of the grid if below 1
+
+    random_state : int, default: ``None``
+        Seed for the sample, combined with the lens number
+        """
+
+    def __init__(self, budget, random_state = None):
+        self.budget = budget
+        self.random_state = random_state
+
+    def propose(self, grid, scores, lens_index):
+        if scores:
+            return []
+        budget = int(np.ceil(self.budget * len(grid))) if self.budget < 1 else int(self.budget)
+        rng = np.random.default_rng(None if self.random_state is None else [self.random_state, lens_index])
+        chosen = rng.choice(len(grid), min(budget, len(grid)), replace=False)
+        return [grid[k] for k in sorted(chosen)]
+
+
+class CoarseToFine(SearchStrategy):
+    """Build a coarse grid taking every step-th interval and overlap option, then refine
+    around every point scoring above zero by building its neighbours within radius
+
+    Parameters
+    ----------
+
+    step : int, default: ``2``
+        Spacing of the coarse grid
+
+    radius : int, default: ``1``
+        Neighbourhood of a successful point that is refined
+        """
+
+    def __init__(self, step = 2, radius = 1):
+        self.step = step
+        self.radius = radius
+
+    def propose(self, grid, scores, lens_index):
+        if not scores:
+            intervals = sorted({i for i, o in grid})[::self.step]
+            overlaps = sorted({o for i, o in grid})[::self.step]
+            return [p for p in grid if p[0] in intervals and p[1] in overlaps]
+
+        refine = []
+        for point, score in scores.items():
+            if score > 0:
+                refine.extend(p for p in self._neighbours(grid, point, self.radius) if p not in scores and p not in refine)
+        return [p for p in grid if p in refine]
+
+
+class SuccessiveHalving(SearchStrategy):
+    """Build n_initial random grid points, then in each round keep the best 1/eta of the
+    candidates and build their unexplored neighbours as new candidates. The lens is
+    finished when no candidate is kept or every neighbour has been built
+
+    Parameters
+    ----------
+
+    n_initial : int, default: ``16``
+        Number of grid points in the first round
+
+    eta : int, default: ``2``
+        Fraction of candidates kept in each round is 1/eta
+
+    random_state : int, default: ``None``
+        Seed for the first round, combined with the lens number
+        """
+
+    def __init__(self, n_initial = 16, eta = 2, random_state = None):
+        self.n_initial = n_initial
+        self.eta = eta
+        self.random_state = random_state
+        self._candidates = {}
+
+    def propose(self, grid, scores, lens_index):
+        if not scores:
+            rng = np.random.default_rng(None if self.random_state is None else [self.random_state, lens_index])
+            chosen = rng.choice(len(grid), min(self.n_initial, len(grid)), replace=False)
+            self._candidates[lens_index] = [grid[k] for k in sorted(chosen)]
+            return list(self._candidates[lens_index])
+
+        #keep the best candidates, ties broken by grid order
+        candidates = self._candidates[lens_index]
+        keep = len(candidates) // self.eta
+        if keep < 1:
+            return []
+        candidates = sorted(candidates, key=lambda p: (-scores[p], grid.index(p)))[:keep]
+
+        #the unexplored neighbours of the kept candidates are built next
+        proposals = set()
+        for point in candidates:
+            proposals.update(p for p in self._neighbours(grid, point, 1) if p not in scores)
+        proposals = [p for p in grid if p in proposals]
+        self._candidates[lens_index] = candidates + proposals
+        return proposals
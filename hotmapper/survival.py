@@ -0,0 +1,81 @@
+"""
+Two-group log-rank tests for many hotspots at once.
+
+Each hotspot splits the cohort into the samples inside the hotspot and the rest.
+The event times are sorted once, and the observed and expected events and the
+variance of every hotspot are found together from sparse products with the
+hotspot membership matrix. The statistics match lifelines.statistics.logrank_test.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import chi2
+
+
+
+def hotspot_membership_matrix(sample_sets, n_samples):
+    """Sparse boolean (samples x hotspots) matrix from a list of sample index arrays"""
+    sample_sets = [np.unique(np.asarray(samples, dtype=np.int64)) for samples in sample_sets]
+    indptr = np.zeros(len(sample_sets) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(samples) for samples in sample_sets])
+    indices = np.concatenate(sample_sets) if sample_sets else np.array([], dtype=np.int64)
+    values = np.ones(len(indices), dtype=bool)
+    return sparse.csc_matrix((values, indices, indptr), shape=(n_samples, len(sample_sets)))
+
+
+def logrank_test_batch(membership, durations, event_observed, block_size = 512):
+    """Log-rank test between the samples in and outside each hotspot.
+
+    Parameters
+    ----------
+
+    membership : (samples x hotspots) boolean array or sparse matrix
+        Column j marks the samples in hotspot j
+
+    durations : array
+        Time to event or censoring for each sample
+
+    event_observed : array
+        1 (True) if the event was observed for the sample, 0 if censored
+
+    block_size : int, default: ``512``
+        Number of hotspots processed together, bounding the memory used
+
+    Returns a dataframe with the test statistic and p-value for each hotspot
+    """
+    durations = np.asarray(durations, dtype=float)
+    event_observed = np.asarray(event_observed).astype(bool)
+    membership = sparse.csc_matrix(membership, dtype=bool)
+    n_samples, n_hotspots = membership.shape
+
+    #sort the event times once, indexing each sample by its time
+    times, time_index = np.unique(durations, return_inverse=True)
+    n_times = len(times)
+    at_time = sparse.csr_matrix((np.ones(n_samples), (time_index, np.arange(n_samples))), shape=(n_times, n_samples))
+    event_at_time = sparse.csr_matrix((event_observed.astype(float), (time_index, np.arange(n_samples))), shape=(n_times, n_samples))
+
+    #cohort totals at each time, only times with events contribute to the test
+    deaths = np.asarray(event_at_time.sum(axis=1)).ravel()
+    at_risk = np.cumsum(np.asarray(at_time.sum(axis=1)).ravel()[::-1])[::-1]
+    event_times = deaths > 0
+    d = deaths[event_times][:, None]
+    n = at_risk[event_times][:, None]
+    variance_factor = np.where(n > 1, d * (n - d) / np.maximum(n - 1, 1), 0.0)
+
+    statistics = np.empty(n_hotspots)
+    for start in range(0, n_hotspots, block_size):
+        block = membership[:, start:start + block_size].astype(float)
+
+        #observed events and samples at risk in the hotspot at each event time
+        observed = np.asarray((event_at_time @ block).todense())[event_times]
+        at_risk_hotspot = np.cumsum(np.asarray((at_time @ block).todense())[::-1], axis=0)[::-1][event_times]
+
+        proportion = at_risk_hotspot / n
+        expected = d * proportion
+        variance = (variance_factor * proportion * (1 - proportion)).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            statistics[start:start + block_size] = np.square(observed.sum(axis=0) - expected.sum(axis=0)) / variance
+
+    return pd.DataFrame({"test_statistic": statistics,
+                         "p_value": chi2.sf(statistics, 1)})
@@ -12,28 +12,129 @@ from statistics import mean
 from itertools import chain
 import pandas as pd
 import matplotlib as mpl
+from scipy import sparse
+from multiprocessing import shared_memory
+import hashlib
+
+def membership_matrix(samples_in_nodes):
+    """Return the sample x node membership as a sparse boolean matrix. Accepts the
+    sparse matrix from MapperGraph.node_membership or the samples_in_nodes dataframe"""
+    if sparse.isspmatrix_csc(samples_in_nodes) and samples_in_nodes.dtype == bool:
+        return samples_in_nodes
+    if sparse.issparse(samples_in_nodes):
+        return sparse.csc_matrix(samples_in_nodes, dtype=bool)
+    return sparse.csc_matrix(np.asarray(samples_in_nodes) != 0)
+
+
+def samples_in_node_list(samples_in_nodes, node_list):
+    """Return the sorted positions of the samples contained in any of the nodes"""
+    membership = membership_matrix(samples_in_nodes)
+    return np.unique(membership[:, list(node_list)].indices)
+
 
 def sample_index_in_nodes(node_index_dataframe, node_list):
-    return node_index_dataframe[node_index_dataframe[node_list].max(axis=1) == 1].index
+    samples = samples_in_node_list(node_index_dataframe, node_list)
+    if isinstance(node_index_dataframe, pd.DataFrame):
+        return node_index_dataframe.index[samples]
+    return samples
+
+def aggregate_node_attributes(node_index_dataframe, attribute):
+    """Per-node count, sum, mean and variance of an attribute over the samples in each node,
+    computed in one sparse product with the membership matrix. The attribute is a value
+    for each sample, or a (samples x k) matrix to aggregate k attributes in one pass"""
+    membership = membership_matrix(node_index_dataframe)
+    attribute = np.asarray(attribute, dtype=float)
+    single = attribute.ndim == 1
+    attribute = attribute.reshape(len(attribute), -1)
+    k = attribute.shape[1]
+
+    #sum the values and squared values over the samples in each node
+    sums = membership.T @ np.hstack([attribute, np.square(attribute)])
+    count = membership.getnnz(axis=0)
+
+    node_count = count[:, None]
+    node_sum = sums[:, :k]
+    node_mean = node_sum / node_count
+    node_var = np.maximum(sums[:, k:] / node_count - np.square(node_mean), 0)
+
+    if single:
+        node_sum, node_mean, node_var = node_sum[:, 0], node_mean[:, 0], node_var[:, 0]
+
+    return {"count": count, "sum": node_sum, "mean": node_mean, "var": node_var}
+
 
 def colour_nodes_by_attribute(node_index_dataframe, attribute, norm = False):
-    """for each node, create a list of the y values for each index"""
+    """for each node, average the attribute over the samples in that node"""
     if norm == True:
         #normalise y values to range
-        attribute = range01(np.array(attribute))
-
+        attribute = np.ravel(range01(np.array(attribute)))
 
     #the node values are averaged over all patients contained in each node
-    node_values = []
-    for node in node_index_dataframe:
-        index = list(node_index_dataframe[node].loc[node_index_dataframe[node] == 1].index)
-        node_y = [attribute[i] for i in index]
-        node_values.append(np.mean(node_y))
+    node_values = aggregate_node_attributes(node_index_dataframe, attribute)["mean"]
 
-    return node_values
+    return list(node_values)
 
 #
 
+def sample_set_fingerprint(samples):
+    """Hash of a set of sample indexes, identical for the same set in any order"""
+    samples = np.unique(np.asarray(samples, dtype=np.int64))
+    return hashlib.blake2b(samples.data, digest_size=16).hexdigest()
+
+
+def graph_fingerprint(graph):
+    """Hash of the nodes and edges of a graph, identical for the same graph built in any order"""
+    nodes = sorted(repr(node) for node in graph.nodes)
+    edges = sorted(tuple(sorted((repr(u), repr(v)))) for u, v in graph.edges)
+    return hashlib.blake2b(repr((nodes, edges)).encode(), digest_size=16).hexdigest()
+
+
+def minhash_signature(samples, num_perm = 64, seed = 0):
+    """MinHash signature of a set of sample indexes. The fraction of equal values in two
+    signatures estimates the Jaccard similarity of the sets"""
+    prime = np.int64(2**31 - 1)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, prime, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, prime, size=num_perm, dtype=np.int64)
+    samples = np.asarray(samples, dtype=np.int64)
+    if len(samples) == 0:
+        return np.full(num_perm, prime)
+    return ((a[:, None] * samples[None, :] + b[:, None]) % prime).min(axis=1)
+
+
+def share_arrays(arrays):
+    """Copy a dictionary of arrays into shared memory blocks so worker processes can read
+    them without pickling. Returns the specs to attach them in a worker and the blocks,
+    which the caller releases with release_shared_arrays"""
+    specs = {}
+    blocks = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        blocks.append(shm)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        specs[name] = (shm.name, array.shape, array.dtype)
+    return specs, blocks
+
+
+def attach_shared_arrays(specs):
+    """Attach to arrays placed in shared memory by share_arrays. Returns the arrays and the
+    blocks, which must be kept referenced while the arrays are in use"""
+    arrays = {}
+    blocks = []
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return arrays, blocks
+
+
+def release_shared_arrays(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
 def removekey(d, key):
     r = dict(d)
     del r[key]
@@ -84,7 +185,7 @@ def check_hotspot_nodes_in_intervals(mapper, hotspot_nodes):
     # map  nodes to intervals
     nodes_to_intervals = {}
     count = 0
-    while count < mapper.samples_in_nodes.shape[1]:
+    while count < mapper.node_membership.shape[1]:
         for k,v in mapper.node_count_in_intervals.items():
             for i in range(0,v):
                 if k in nodes_to_intervals:
@@ -4,19 +4,52 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import hotmapper.utils as utils
+from collections import OrderedDict
 
 
 
 plt.rcParams.update({'font.size': 36})
 
+#layout functions of each style, only the requested style is computed
+_layout_styles = {1: lambda graph: nx.fruchterman_reingold_layout(graph, seed=300),
+                  2: nx.kamada_kawai_layout,
+                  3: nx.nx_pydot.graphviz_layout}
+
+#node positions keyed by graph fingerprint and style, least recently used dropped first
+_layout_cache = OrderedDict()
+_layout_cache_size = 32
+
+
+def graph_layout(graph, style = 1):
+    """Node positions of the graph in the layout style, cached so replotting the same
+    graph with different colourings or hotspots reuses the positions"""
+    if style not in _layout_styles:
+        raise ValueError(F"unknown style {style}, use 1 (fruchterman_reingold), 2 (kamada_kawai) or 3 (graphviz)")
+
+    key = (utils.graph_fingerprint(graph), style)
+    if key in _layout_cache:
+        _layout_cache.move_to_end(key)
+    else:
+        _layout_cache[key] = _layout_styles[style](graph)
+        while len(_layout_cache) > _layout_cache_size:
+            _layout_cache.popitem(last=False)
+    return dict(_layout_cache[key])
+
+
+def clear_layout_cache():
+    """Remove all cached layouts"""
+    _layout_cache.clear()
+
+
 def draw_graph(mapper_graph, attribute_function, samples_in_nodes, hotspot_nodes = None,  style = 1, size = 1, labels = False, tick_labels = False, col_legend_title = "Legend", file_name = None, file_format = "png"):
     """Visualise the networkx graph.
 
     Parameters
     ----------
 
-    style : [1],[2], default: ``1``
-        Selects either fruchterman_reingold_layout from networkx (1) or kamada_kawai_layout (2) to structure the graph
+    style : [1],[2],[3], default: ``1``
+        Selects either fruchterman_reingold_layout from networkx (1), kamada_kawai_layout (2) or graphviz_layout (3) to structure the graph.
+        Only the selected layout is computed, and it is cached for the graph
 
     size : int, default: ``10``
         Size of node legends specifying the number of samples per nodes
@@ -30,14 +63,11 @@ def draw_graph(mapper_graph, attribute_function, samples_in_nodes, hotspot_nodes
         """
 
     graph = mapper_graph.copy()
-    network_styles = {1: nx.fruchterman_reingold_layout(graph, seed=300),
-                      2: nx.kamada_kawai_layout(graph),
-                      3: nx.nx_pydot.graphviz_layout(graph)}
 
     #Plot figure with legend, specifying style
     cmap = mpl.cm.viridis
     fig = plt.figure(figsize=(12, 12), constrained_layout=True)
-    pos =  network_styles[style]
+    pos = graph_layout(graph, style)
 
 
     #colour the nodes by the attribute of choice
@@ -55,7 +85,7 @@ def draw_graph(mapper_graph, attribute_function, samples_in_nodes, hotspot_nodes
     colouring = cmap(norm((attribute_by_node)))
 
     #specify the number of samples in each node according to size attribute
-    nsize = [np.sum(samples_in_nodes[node]) for node in samples_in_nodes]
+    nsize = list(utils.membership_matrix(samples_in_nodes).getnnz(axis=0))
     nodes = nx.draw_networkx_nodes(graph,
                               pos= pos,
                               node_color=colouring,
@@ -0,0 +1,39 @@
+import numpy as np
+from hdbscan import HDBSCAN
+from hotmapper.automated_parameter_search import Search
+
+
+
+def _parameters(attribute_function):
+    return {"predefined_lens": None,
+            "non_zero_lens_features": 5,
+            "interval_list": range(6, 30, 4),
+            "overlap_list": [0.2, 0.3, 0.4],
+            "clustering_algorithm": HDBSCAN(min_cluster_size=5),
+            "attribute_function": attribute_function,
+            "epsilon": 0.1,
+            "min_samples": 15,
+            "extreme": "higher"}
+
+
+def _fingerprints(result):
+    return sorted(h["fingerprint"] for h in result.distinct_hotspots)
+
+
+def test_build_graphs_twice_keeps_only_the_second_search():
+    rng = np.random.default_rng(0)
+    X = np.vstack([rng.normal(0, 1, (300, 20)), rng.normal(2, 1, (200, 20))])
+    first_attribute = (rng.random(500) < np.where(np.arange(500) < 300, 0.1, 0.6)).astype(int)
+    second_attribute = (rng.random(500) < np.where(np.arange(500) < 300, 0.6, 0.1)).astype(int)
+
+    search = Search(X, runs = 5, random_state = 1)
+    first = search.build_graphs(_parameters(first_attribute))
+    second = search.build_graphs(_parameters(second_attribute))
+    fresh = Search(X, runs = 5, random_state = 1).build_graphs(_parameters(second_attribute))
+
+    assert first.status == "found" and second.status == "found"
+    assert set(_fingerprints(first)).isdisjoint(_fingerprints(second))
+    assert _fingerprints(second) == _fingerprints(fresh)
+    assert second.parameters.keys() == fresh.parameters.keys()
+    assert second.hotspot_graphs == fresh.hotspot_graphs == len(fresh.parameters)
+    assert [h["grid_points"] for h in second.distinct_hotspots] == [h["grid_points"] for h in fresh.distinct_hotspots]